@@ -1,52 +1,376 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from datetime import date
+import argparse
+import csv
+import functools
+import io
+import itertools
+import os
+import time
+import codec
 import database  # Imports your database.py file
+import metrics
+import records
+from profiler import SamplingProfiler
+from response_cache import ResponseCache
+
+class JSONProvider(DefaultJSONProvider):
+    """Encodes responses with codec.py (orjson when installed). The JSON
+    store hands out compact records (records.Item); this is where they
+    turn back into plain JSON objects."""
+
+    @staticmethod
+    def default(o):
+        return records.json_default(o) if isinstance(o, records.Item) else DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        return codec.dumps_str(obj, self.default)
+
+    def loads(self, s, **kwargs):
+        return codec.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(codec.dumps(obj, self.default), mimetype=self.mimetype)
 
 app = Flask(__name__)
-CORS(app)
+app.json = JSONProvider(app)
+CORS(app, expose_headers=["X-Next-Cursor", "X-Total-Count", "ETag"])
+
+ITEM_FIELDS = ["id", "name", "publication_date", "author", "category",
+               "status", "borrow_date", "borrower", "version"]
+MAX_PAGE_SIZE = 1000
+DEFAULT_PAGE_SIZE = 50
+
+# --- LIST RESPONSES (pagination, projection, streaming) ---
+# All list endpoints accept:
+#   ?limit=N        page size (capped at MAX_PAGE_SIZE); the cursor for the
+#                   next page comes back in the X-Next-Cursor header
+#   ?cursor=...     value of X-Next-Cursor from the previous page
+#   ?offset=N&sort=[-]field
+#                   random access in any order (the total comes back in
+#                   X-Total-Count); used by the desktop app's virtual list
+#   ?fields=a,b     only return these item fields
+#   Accept: application/x-ndjson (or ?format=ndjson) for one item per line
+# The body is generated item by item, so the full catalog is never held as
+# one list or one string in memory.
+
+class BadRequest(Exception):
+    pass
+
+@app.errorhandler(BadRequest)
+def bad_request(e):
+    return jsonify({"error": str(e)}), 400
+
+def _int_arg(name, default=None):
+    value = request.args.get(name)
+    if value in (None, ""):
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise BadRequest(f"'{name}' must be an integer")
+
+def _date_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise BadRequest(f"'{name}' must be a YYYY-MM-DD date")
+
+def _fields_arg():
+    fields = request.args.get("fields")
+    if not fields:
+        return None
+    fields = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in fields if f not in ITEM_FIELDS]
+    if unknown:
+        raise BadRequest(f"Unknown fields: {unknown}. Allowed: {ITEM_FIELDS}")
+    return fields
+
+def _wants_ndjson():
+    if request.args.get("format") == "ndjson":
+        return True
+    accept = request.accept_mimetypes
+    return accept["application/x-ndjson"] > accept["application/json"]
+
+def _encode(items, fields, ndjson):
+    if fields:
+        items = ({f: item.get(f) for f in fields} for item in items)
+    if ndjson:
+        for item in items:
+            yield codec.dumps(item) + b"\n"
+        return
+    yield b"["
+    for i, item in enumerate(items):
+        yield (b"," if i else b"") + codec.dumps(item)
+    yield b"]"
+
+def list_response(items, cursor_of=None, total=None):
+    """Streams `items` (an iterator) as a JSON array or NDJSON.
+
+    With ?limit, one extra item is read to know whether there is a next
+    page; `cursor_of(last_item, count)` turns the page into the cursor.
+    """
+    limit = _int_arg("limit")
+    fields = _fields_arg()
+    ndjson = _wants_ndjson()
+    headers = {}
+    if total is not None:
+        headers["X-Total-Count"] = str(total)
+    if limit is not None and cursor_of is not None:
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        page = list(itertools.islice(items, limit + 1))
+        if len(page) > limit:
+            page = page[:limit]
+            headers["X-Next-Cursor"] = str(cursor_of(page[-1], len(page)))
+        items = iter(page)
+    mimetype = "application/x-ndjson" if ndjson else "application/json"
+    return Response(_encode(items, fields, ndjson), mimetype=mimetype, headers=headers)
+
+def _id_cursor(item, count):
+    return item["id"]
+
+def _filters_arg():
+    """?category=&status=&author= as a dict of the ones given."""
+    return {f: request.args[f] for f in database.FILTER_FIELDS if request.args.get(f)}
+
+def _wants_page():
+    return "offset" in request.args or "sort" in request.args
+
+def _page_args():
+    offset = max(0, _int_arg("offset", 0))
+    limit = max(1, min(_int_arg("limit", DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+    return request.args.get("sort"), offset, limit
+
+def page_response(page_fn, *args):
+    """Offset/sort paging: page_fn(*args, sort, offset, limit) -> (total, items)."""
+    try:
+        total, items = page_fn(*args, *_page_args())
+    except ValueError as e:
+        raise BadRequest(str(e))
+    return list_response(iter(items), total=total)
+
+# --- CONDITIONAL GET & RESPONSE CACHE ---
+# Cacheable GETs carry the store revision as their ETag. A client that sends
+# it back in If-None-Match gets a 304 while nothing has changed, and repeated
+# identical requests at the same revision are answered from an LRU of
+# already-serialized bodies (no store lookup, no JSON encoding).
+RESPONSES = ResponseCache()
+
+def cached(view=None, dated=None):
+    """`dated()` is true for requests whose answer also depends on today's
+    date; their ETag and cache key then include the date."""
+    if view is None:
+        return functools.partial(cached, dated=dated)
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        etag = str(database.revision())
+        if dated is not None and dated():
+            etag += "-" + date.today().isoformat()
+        if request.if_none_match.contains(etag):
+            resp = Response(status=304)
+        else:
+            key = (request.path, request.query_string, _wants_ndjson(), etag)
+            hit = RESPONSES.get(key)
+            if hit is not None:
+                body, mimetype, headers = hit
+                resp = Response(body, mimetype=mimetype, headers=headers)
+            else:
+                resp = app.make_response(view(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+                headers = {k: v for k, v in resp.headers.items() if k in ("X-Next-Cursor", "X-Total-Count")}
+                if resp.is_streamed:
+                    resp.response = RESPONSES.collect(key, resp.response, resp.mimetype, headers)
+                else:
+                    RESPONSES.put(key, resp.get_data(), resp.mimetype, headers)
+        resp.set_etag(etag)
+        resp.vary.add("Accept")
+        return resp
+    return wrapper
 
 # --- STANDARD ENDPOINTS ---
 
 @app.route("/media", methods=["GET"])
+@cached
 def get_all():
-    return jsonify(database.list_all())
+    # ?category=Film&status=Available&author=... intersects the secondary indexes
+    filters = _filters_arg()
+    if filters:
+        if _wants_page():
+            return page_response(database.filter_page, filters)
+        return list_response(database.filter_items(filters, after_id=_int_arg("cursor", 0)), _id_cursor)
+    if _wants_page():
+        return page_response(database.list_page, None)
+    return list_response(database.iter_items(after_id=_int_arg("cursor", 0)), _id_cursor)
 
 @app.route("/media", methods=["POST"])
 def create():
     d = request.json
-    new_item = database.create_item(
-        name=d.get("name"), 
-        publication_date=d.get("publication_date"), 
-        author=d.get("author"), 
-        category=d.get("category")
-    )
+    try:
+        new_item = database.create_item(
+            name=d.get("name"), 
+            publication_date=d.get("publication_date"), 
+            author=d.get("author"), 
+            category=d.get("category")
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     return jsonify(new_item), 201
 
 @app.route("/media/category/<cat>", methods=["GET"])
+@cached
 def get_by_cat(cat):
-    return jsonify(database.list_by_category(cat))
+    if _wants_page():
+        return page_response(database.list_page, cat)
+    return list_response(database.filter_items({"category": cat}, after_id=_int_arg("cursor", 0)), _id_cursor)
 
 @app.route("/media/search", methods=["GET"])
+@cached
 def search():
     name = request.args.get("name", "")
-    return jsonify(database.search_smart(name))
+    mode = request.args.get("mode", "smart")
+    if _wants_page():
+        return page_response(database.search_page, name, mode)
+    # Search results are ranked, not id ordered: the cursor is an offset
+    offset = _int_arg("cursor", 0)
+    limit = _int_arg("limit")
+    if limit is not None:
+        limit = max(1, min(limit, MAX_PAGE_SIZE)) + 1   # + 1: list_response looks one past the page
+    try:
+        results = database.iter_search(name, mode, offset, limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return list_response(results, lambda item, count: offset + count)
+
+@app.route("/media/changes", methods=["GET"])
+def get_changes():
+    """Delta sync: ?since=<revision> returns only what changed after it.
+    "reset": true means the history is gone and the client must reload."""
+    since = _int_arg("since")
+    if since is None:
+        raise BadRequest("'since' is required")
+    revision, changes = database.changes_since(since)
+    return jsonify({"revision": revision, "reset": changes is None, "changes": changes or []})
+
+# --- LIVE EVENTS (Server-Sent Events) ---
+# GET /media/events?since=<revision> keeps the connection open and sends a
+# "change" event, shaped like a /media/changes answer plus the revision it
+# follows ("since"), whenever the catalog changes. Event ids are revisions,
+# so an EventSource that reconnects resumes where it left off
+# (Last-Event-ID). An idle stream still looks for other worker processes'
+# changes every EVENTS_POLL_SECONDS and sends a comment line every
+# EVENTS_KEEPALIVE_SECONDS.
+EVENTS_POLL_SECONDS = 1.0
+EVENTS_KEEPALIVE_SECONDS = 15.0
+
+def _sse(message):
+    return b"id: %d\nevent: change\ndata: %s\n\n" % (message["revision"], codec.dumps(message))
+
+def _event_stream(since):
+    sub = database.subscribe()
+    try:
+        if since is None:
+            database.catch_up()
+            sent = database.revision()
+            yield _sse({"since": None, "revision": sent, "reset": False, "changes": []})
+        else:
+            sent, message = _resync(since)
+            yield _sse(message)
+        idle = 0.0
+        while True:
+            messages = sub.get(EVENTS_POLL_SECONDS)
+            if messages is None:
+                # Our queue overflowed: catch up from the change log instead
+                sent, message = _resync(sent)
+                yield _sse(message)
+                continue
+            for message in messages:
+                if message["reset"]:
+                    sent = message["revision"]
+                    yield _sse(dict(message, since=None))
+                elif message["revision"] == sent + 1:
+                    yield _sse(dict(message, since=sent))
+                    sent = message["revision"]
+                elif message["revision"] > sent:
+                    # Commits published out of order, or several foreign ones at once
+                    sent, message = _resync(sent)
+                    yield _sse(message)
+            if messages:
+                idle = 0.0
+                continue
+            database.catch_up()
+            idle += EVENTS_POLL_SECONDS
+            if idle >= EVENTS_KEEPALIVE_SECONDS:
+                idle = 0.0
+                yield b": keep-alive\n\n"
+    finally:
+        sub.close()
+
+def _resync(since):
+    revision, changes = database.changes_since(since)
+    return revision, {"since": since, "revision": revision, "reset": changes is None, "changes": changes or []}
+
+@app.route("/media/events", methods=["GET"])
+def get_events():
+    since = _int_arg("since")
+    last_id = request.headers.get("Last-Event-ID", "")
+    if since is None and last_id.isdigit():
+        since = int(last_id)
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(_event_stream(since), mimetype="text/event-stream", headers=headers)
 
 @app.route("/media/<int:id>", methods=["GET"])
 def get_one(id):
+    # The ETag is the item's own version (not the store revision), so it can
+    # be sent back as If-Match when saving an edit.
     item = database.get_item(id)
-    return jsonify(item) if item else (jsonify({"error": "Not found"}), 404)
+    if not item:
+        return jsonify({"error": "Not found"}), 404
+    etag = str(item.get("version", 1))
+    resp = Response(status=304) if request.if_none_match.contains(etag) else jsonify(item)
+    resp.set_etag(etag)
+    return resp
+
+def _expected_version(d):
+    """Optimistic locking: the client sends the version it edited, either in
+    the body or as If-Match (the ETag of GET /media/<id>). A stale version
+    gets a 409; "If-Match: *" or neither means no check."""
+    version = d.get("version")
+    if version is None:
+        tag = request.headers.get("If-Match", "").strip()
+        if tag in ("", "*"):
+            return None
+        version = tag[2:] if tag.startswith("W/") else tag
+        version = version.strip('"')
+    if isinstance(version, int) and not isinstance(version, bool):
+        return version
+    if isinstance(version, str) and version.isdigit():
+        return int(version)
+    raise BadRequest("version (or If-Match) must be an item version number")
 
 @app.route("/media/<int:id>", methods=["PUT"])
 def update(id):
     d = request.json
-    updated_item = database.update_item(
-        item_id=id,
-        name=d.get("name"),
-        pub=d.get("publication_date"),
-        auth=d.get("author"),
-        cat=d.get("category")
-    )
+    try:
+        updated_item = database.update_item(
+            item_id=id,
+            name=d.get("name"),
+            pub=d.get("publication_date"),
+            auth=d.get("author"),
+            cat=d.get("category"),
+            expected_version=_expected_version(d)
+        )
+    except database.VersionConflict as e:
+        return jsonify({"error": str(e), "current": e.item}), 409
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     if updated_item:
         return jsonify(updated_item)
     return jsonify({"error": "Not found"}), 404
@@ -70,7 +394,10 @@ def borrow_item(id):
     if not borrow_date:
         borrow_date = date.today().isoformat()
     
-    item = database.set_status(id, "Checked Out", borrow_date, borrower_name)
+    try:
+        item = database.set_status(id, "Checked Out", borrow_date, borrower_name, expected_status="Available")
+    except database.VersionConflict as e:
+        return jsonify({"error": str(e), "current": e.item}), 409
     
     if item:
         return jsonify(item)
@@ -84,28 +411,262 @@ def return_item(id):
         return jsonify(item)
     return jsonify({"error": "Not found"}), 404
 
+# --- LOAN HISTORY ---
+# Answered from the loan ledger's indexes (loans.py), not by scanning items.
+
+@app.route("/media/<int:id>/history", methods=["GET"])
+@cached
+def item_history(id):
+    """Every check-out and return of the item, oldest first"""
+    events = database.item_history(id)
+    if not events and database.get_item(id) is None:
+        return jsonify({"error": "Not found"}), 404
+    return jsonify(events)
+
+@app.route("/patrons/<name>/loans", methods=["GET"])
+@cached
+def patron_loans(name):
+    """What the patron has out (?history=1: all their loan events)"""
+    history = request.args.get("history") in ("1", "true")
+    return jsonify(database.patron_loans(name, history=history))
+
+@app.route("/loans/overdue", methods=["GET"])
+def overdue_loans():
+    """Open loans due before ?as_of= (default today), most overdue first"""
+    limit = _int_arg("limit")
+    return jsonify(database.overdue_loans(_date_arg("as_of"), None if limit is None else max(0, limit)))
+
+# --- BULK IMPORT / EXPORT & BATCH ACTIONS ---
+
+def _bulk_rows():
+    """Parses the upload as CSV (text/csv), NDJSON (application/x-ndjson) or
+    a JSON array. Unparseable NDJSON lines become None and are reported."""
+    if request.mimetype == "text/csv":
+        return list(csv.DictReader(io.StringIO(request.get_data(as_text=True))))
+    if request.mimetype == "application/x-ndjson":
+        rows = []
+        for line in request.get_data(as_text=True).splitlines():
+            if not line.strip():
+                continue
+            try:
+                rows.append(codec.loads(line))
+            except ValueError:
+                rows.append(None)
+        return rows
+    rows = request.get_json(silent=True)
+    if not isinstance(rows, list):
+        raise BadRequest("Expected a JSON array, NDJSON or CSV body")
+    return rows
+
+@app.route("/media/bulk", methods=["POST"])
+def bulk_create():
+    """Creates many items in one write; bad rows are skipped and reported."""
+    created, errors = database.create_items(_bulk_rows())
+    body = {"created": len(created), "ids": [m["id"] for m in created], "errors": errors}
+    return jsonify(body), 201 if created or not errors else 400
+
+def _batch_ids():
+    ids = (request.get_json(silent=True) or {}).get("ids")
+    if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+        raise BadRequest("Expected {\"ids\": [1, 2, ...]}")
+    return ids
+
+def _batch_result(done, errors):
+    return jsonify({"ok": done, "errors": errors})
+
+@app.route("/media/batch/borrow", methods=["POST"])
+def batch_borrow():
+    d = request.get_json(silent=True) or {}
+    items, errors = database.set_status_many(
+        _batch_ids(), "Checked Out",
+        d.get("borrow_date") or date.today().isoformat(),
+        d.get("borrower", "Unknown"),
+        expected_status="Available")
+    return _batch_result([m["id"] for m in items], errors)
+
+@app.route("/media/batch/return", methods=["POST"])
+def batch_return():
+    items, errors = database.set_status_many(_batch_ids(), "Available", None, None)
+    return _batch_result([m["id"] for m in items], errors)
+
+@app.route("/media/batch/delete", methods=["POST"])
+def batch_delete():
+    return _batch_result(*database.delete_items(_batch_ids()))
+
+def _csv_rows(items, fields):
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=fields, extrasaction="ignore")
+    writer.writeheader()
+    for item in items:
+        writer.writerow(item)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    yield buf.getvalue()
+
+@app.route("/media/export", methods=["GET"])
+def export():
+    """Streams the whole catalog as ?format=ndjson (default), json or csv."""
+    fmt = request.args.get("format", "ndjson")
+    fields = _fields_arg()
+    items = database.iter_items()
+    if fmt == "csv":
+        body, mimetype = _csv_rows(items, fields or ITEM_FIELDS), "text/csv"
+    elif fmt in ("json", "ndjson"):
+        body = _encode(items, fields, fmt == "ndjson")
+        mimetype = "application/x-ndjson" if fmt == "ndjson" else "application/json"
+    else:
+        raise BadRequest("'format' must be ndjson, json or csv")
+    headers = {"Content-Disposition": f"attachment; filename=media_export.{fmt}"}
+    return Response(body, mimetype=mimetype, headers=headers)
+
+def _overdue_as_of_today():
+    return "overdue" in request.args.get("breakdown", "").split(",") and not request.args.get("as_of")
+
 @app.route("/stats", methods=["GET"])
+@cached(dated=_overdue_as_of_today)
 def get_stats():
-    items = database.list_all()
+    # Running totals kept by the database layer: no scan per request
+    counts = database.stats()
+    categories, statuses = counts["by_category"], counts["by_status"]
     stats = {
-        "total": len(items), 
-        "Book": 0, 
-        "Film": 0, 
-        "Magazine": 0, 
-        "Borrowed": 0
+        "total": counts["total"], 
+        "Book": categories.get("Book", 0), 
+        "Film": categories.get("Film", 0), 
+        "Magazine": categories.get("Magazine", 0), 
+        "Borrowed": statuses.get("Checked Out", 0)
     }
-    
-    for item in items:
-        cat = item.get("category", "Book")
-        if cat in stats: 
-            stats[cat] += 1
-        
-        if item.get("status") == "Checked Out":
-            stats["Borrowed"] += 1
-            
+
+    # Optional extras: ?breakdown=borrowers,overdue (&as_of=YYYY-MM-DD)
+    extras = request.args.get("breakdown", "").split(",")
+    if "borrowers" in extras:
+        stats["by_borrower"] = counts["by_borrower"]
+    if "overdue" in extras:
+        stats["Overdue"] = database.overdue_count(_date_arg("as_of"))
+        stats["loan_period_days"] = database.LOAN_PERIOD_DAYS
     return jsonify(stats)
 
+@app.route("/stats/verify", methods=["GET", "POST"])
+def verify_stats():
+    """Recounts from scratch to detect drift; POST also repairs it."""
+    result = database.verify_stats(repair=request.method == "POST")
+    return jsonify(result), 200 if result["ok"] else 409
+
+# --- METRICS & PROFILING ---
+# GET /metrics is scraped by Prometheus. Requests slower than
+# SLOW_REQUEST_MS (env BOOKHAVEN_SLOW_MS, 0 = off) are also logged; the
+# threshold and the sampling profiler can be changed while running through
+# /debug/slow-log and /debug/profile. Those two let any client change how
+# the server runs, so they only exist with BOOKHAVEN_DEBUG_ENDPOINTS=1.
+SLOW_REQUEST_MS = float(os.environ.get("BOOKHAVEN_SLOW_MS", "0"))
+DEBUG_ENDPOINTS = os.environ.get("BOOKHAVEN_DEBUG_ENDPOINTS") == "1"
+PROFILER = SamplingProfiler()
+
+@app.before_request
+def _start_timer():
+    g.started = time.perf_counter()
+
+@app.after_request
+def _time_request(resp):
+    # Recorded once the body has been sent, so streamed lists count in full
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    method, started = request.method, g.get("started", time.perf_counter())
+    request_line = f"{method} {request.full_path.rstrip('?')}"
+    resp.call_on_close(lambda: _record_request(route, method, resp.status_code, request_line, started))
+    return resp
+
+def _record_request(route, method, status, request_line, started):
+    if route == "/media/events":
+        # Event streams stay open for hours: count them, but not as latency
+        metrics.inc("bookhaven_http_requests_total", route=route, method=method, status=status)
+        return
+    seconds = time.perf_counter() - started
+    metrics.observe("bookhaven_http_request_seconds", seconds, route=route, method=method)
+    metrics.inc("bookhaven_http_requests_total", route=route, method=method, status=status)
+    if SLOW_REQUEST_MS and seconds * 1000 >= SLOW_REQUEST_MS:
+        metrics.inc("bookhaven_slow_requests_total", route=route)
+        app.logger.warning("Slow request: %s -> %s in %.0f ms", request_line, status, seconds * 1000)
+
+def _store_gauges():
+    counts = database.stats()
+    return {(("what", "items"),): counts["total"],
+            (("what", "revision"),): database.revision(),
+            (("what", "file_bytes"),): database.store_size()}
+
+metrics.gauge("bookhaven_catalog", "Catalog size: items, store revision and bytes on disk", _store_gauges)
+metrics.gauge("bookhaven_response_cache", "Response cache lookups and size",
+              lambda: {(("what", "hits"),): RESPONSES.hits, (("what", "misses"),): RESPONSES.misses,
+                       (("what", "entries"),): len(RESPONSES)})
+metrics.gauge("bookhaven_event_streams", "Open /media/events connections",
+              lambda: {(): database.subscriber_count()})
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+def slow_log():
+    """POST {"threshold_ms": 250} to log slower requests; 0 turns it off."""
+    global SLOW_REQUEST_MS
+    if request.method == "POST":
+        try:
+            SLOW_REQUEST_MS = float((request.get_json(silent=True) or {}).get("threshold_ms", 0))
+        except (TypeError, ValueError):
+            raise BadRequest("'threshold_ms' must be a number")
+    return jsonify({"threshold_ms": SLOW_REQUEST_MS})
+
+def profile():
+    """POST {"enabled": true, "interval_ms": 5} starts sampling (from
+    scratch), {"enabled": false} stops it. GET returns the samples as
+    collapsed stacks, ready for flamegraph.pl or speedscope."""
+    if request.method == "POST":
+        d = request.get_json(silent=True) or {}
+        if d.get("enabled"):
+            try:
+                interval = float(d.get("interval_ms", PROFILER.interval * 1000)) / 1000
+            except (TypeError, ValueError):
+                raise BadRequest("'interval_ms' must be a number")
+            PROFILER.start(max(interval, 0.001))
+        else:
+            PROFILER.stop()
+        return jsonify({"running": PROFILER.running, "interval_ms": PROFILER.interval * 1000})
+    headers = {"X-Profiler-Running": str(PROFILER.running).lower(), "X-Profiler-Samples": str(PROFILER.samples)}
+    return Response(PROFILER.report(_int_arg("limit")), mimetype="text/plain", headers=headers)
+
+if DEBUG_ENDPOINTS:
+    app.add_url_rule("/debug/slow-log", view_func=slow_log, methods=["GET", "POST"])
+    app.add_url_rule("/debug/profile", view_func=profile, methods=["GET", "POST"])
+
+# --- SERVING ---
+def create_app(storage=None, path=None):
+    """WSGI entry point for production servers, e.g.
+
+        gunicorn -w 4 -k gthread --threads 32 -b 0.0.0.0:8000 "backend:create_app()"
+
+    The store comes from the arguments or BOOKHAVEN_STORAGE / BOOKHAVEN_PATH.
+    It is opened and indexed here, so the first request doesn't pay for it.
+    """
+    storage = storage or os.environ.get("BOOKHAVEN_STORAGE")
+    path = path or os.environ.get("BOOKHAVEN_PATH")
+    if path or (storage and storage != database.STORAGE):
+        database.configure(storage, path)
+    database.warm_up()
+    return app
+
 if __name__ == "__main__":
-    database._init_store()
-    print("Backend Server Running on http://127.0.0.1:8000")
-    app.run(host="127.0.0.1", port=8000, debug=True)
\ No newline at end of file
+    import server
+
+    parser = argparse.ArgumentParser(description="Book Haven API server")
+    parser.add_argument("--host", default=os.environ.get("BOOKHAVEN_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("BOOKHAVEN_PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("BOOKHAVEN_WORKERS", "1")),
+                        help="worker processes sharing the store")
+    parser.add_argument("--storage", choices=["json", "wal", "sqlite"], help="overrides BOOKHAVEN_STORAGE")
+    parser.add_argument("--path", help="store file (media_store.json / media_store.db by default)")
+    parser.add_argument("--debug", action="store_true", help="Flask development server with reloader and debugger")
+    args = parser.parse_args()
+
+    print(f"Backend Server Running on http://{args.host}:{args.port}")
+    if args.debug:
+        create_app(args.storage, args.path).run(host=args.host, port=args.port, debug=True)
+    else:
+        server.serve(lambda: create_app(args.storage, args.path), args.host, args.port, args.workers)
\ No newline at end of file
@@ -0,0 +1,508 @@
+"""Benchmarks for the database layer and the HTTP API on synthetic catalogs.
+
+    python benchmark.py --items 200000                # single-call timings
+    python benchmark.py --workload --items 100000 --threads 8 --target http
+    python benchmark.py --suite --sizes 1000,100000,1000000 --out bench.json
+    python benchmark.py --suite --compare bench.json  # fail on regressions
+    python benchmark.py --memory --items 1000000     # compact records vs dicts
+    python benchmark.py --write-catalog big.json --items 1000000
+
+The real media_store.json is never touched: catalogs are generated into a
+temporary folder and the database module is configured to use it. Every
+run is seeded, so two runs with the same arguments do the same work.
+"""
+import argparse
+import atexit
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from datetime import date, timedelta
+
+import codec
+import database
+from sqlite_store import SqliteStore
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# --- SYNTHETIC CATALOG ---
+# Skewed like a real library: mostly books, a long tail of authors where a
+# few are very popular (Zipf), recent publications more common than old
+# ones, and a share of the collection out on loan to a pool of patrons,
+# some of it overdue.
+CATEGORIES = ["Book", "Film", "Magazine"]
+CATEGORY_WEIGHTS = [70, 18, 12]
+WORDS = ["Clean", "Code", "Dad", "Rich", "Poor", "Ocean", "Night", "River",
+         "Empire", "Garden", "Silent", "Storm", "Python", "Journey", "Secret",
+         "Winter", "Shadow", "Glass", "Iron", "Light", "House", "City", "Road",
+         "Star", "Fire", "Letters", "History", "Guide", "Last", "Little"]
+FIRST_NAMES = ["Robert", "Jane", "Haruki", "Agatha", "Mark", "Toni", "Chinua",
+               "Ursula", "Gabriel", "Virginia", "James", "Maya", "Leo", "Zadie",
+               "Kazuo", "Elena", "Orhan", "Isabel", "Yuval", "Octavia"]
+LAST_NAMES = ["Martin", "Austen", "Murakami", "Christie", "Twain", "Morrison",
+              "Achebe", "Le Guin", "Marquez", "Woolf", "Baldwin", "Angelou",
+              "Tolstoy", "Smith", "Ishiguro", "Ferrante", "Pamuk", "Allende",
+              "Harari", "Butler", "Kiyosaki", "Rajamouli", "Atwood", "Rowling"]
+ON_LOAN = 0.15          # share of the catalog that is checked out
+LOAN_WINDOW_DAYS = 45   # loans started up to this long ago (some are overdue)
+TODAY = date(2024, 6, 1)
+
+
+def _zipf_weights(n, s=1.1):
+    return [1 / (rank ** s) for rank in range(1, n + 1)]
+
+
+def _people(rnd, count):
+    return [f"{rnd.choice(FIRST_NAMES)} {rnd.choice(LAST_NAMES)} {i}" if i >= 200
+            else f"{rnd.choice(FIRST_NAMES)} {rnd.choice(LAST_NAMES)}" for i in range(count)]
+
+
+def iter_catalog(n, seed=42):
+    """Yields `n` synthetic items with ids 1..n."""
+    rnd = random.Random(seed)
+    authors = _people(rnd, max(20, n // 25))
+    patrons = _people(rnd, max(10, n // 50))
+    # Cumulative weights, so each draw is a bisect instead of a pass over the weights
+    author_cum = list(itertools.accumulate(_zipf_weights(len(authors))))
+    patron_cum = list(itertools.accumulate(_zipf_weights(len(patrons), 0.8)))
+    word_cum = list(itertools.accumulate(_zipf_weights(len(WORDS), 0.7)))
+    block = 4096
+    for start in range(1, n + 1, block):
+        size = min(block, n + 1 - start)
+        cats = rnd.choices(CATEGORIES, CATEGORY_WEIGHTS, k=size)
+        auths = rnd.choices(authors, cum_weights=author_cum, k=size)
+        words = rnd.choices(WORDS, cum_weights=word_cum, k=size * 3)
+        for j in range(size):
+            item = {
+                "id": start + j,
+                "name": " ".join(words[j * 3:j * 3 + 3]),
+                # Triangular: most items were published in the last decades
+                "publication_date": f"{int(rnd.triangular(1900, 2024, 2020))}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}",
+                "author": auths[j],
+                "category": cats[j],
+                "status": "Available",
+                "borrow_date": None,
+                "borrower": None,
+                "version": 1,
+            }
+            if rnd.random() < ON_LOAN:
+                item["status"] = "Checked Out"
+                item["borrower"] = rnd.choices(patrons, cum_weights=patron_cum)[0]
+                item["borrow_date"] = (TODAY - timedelta(days=rnd.randint(0, LOAN_WINDOW_DAYS))).isoformat()
+            yield item
+
+
+def make_catalog(n, seed=42):
+    """The whole synthetic store as a dict (see write_catalog for big n)."""
+    return {"next_id": n + 1, "items": {str(m["id"]): m for m in iter_catalog(n, seed)}}
+
+
+def write_catalog(path, n, seed=42):
+    """Writes a synthetic media_store.json item by item, without building
+    the catalog in memory first."""
+    with open(path, "wb") as f:
+        codec.write_snapshot(f, {"next_id": n + 1}, iter_catalog(n, seed))
+
+
+def prepare(n, storage, seed=42):
+    """Generates a catalog in a temp folder and points `database` at it.
+    The folder is removed when the process exits."""
+    tmp = tempfile.mkdtemp(prefix="bookhaven-bench-")
+    atexit.register(shutil.rmtree, tmp, ignore_errors=True)
+    path = os.path.join(tmp, "media_store.json")
+    write_catalog(path, n, seed)
+    if storage == "sqlite":
+        db_path = os.path.join(tmp, "media_store.db")
+        SqliteStore(db_path).import_json(path)
+        database.configure(storage, db_path)
+    else:
+        database.configure(storage, path)
+    return tmp
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def current_rss_mb():
+    """Resident memory right now (Linux); falls back to the peak elsewhere."""
+    try:
+        with open("/proc/self/statm") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+    except (OSError, ValueError, AttributeError):
+        return peak_rss_mb()
+
+
+# --- MEMORY: compact records vs plain dicts ---
+def load_footprint(n, storage="json", seed=42):
+    """Loads a catalog, then builds the indexes; reports time and memory of
+    each step separately, so the item representation is measured alone."""
+    prepare(n, storage, seed)
+    baseline = current_rss_mb()
+    start = time.perf_counter()
+    database._store().load()
+    loaded, loaded_rss = time.perf_counter(), current_rss_mb()
+    database.warm_up()
+    return {
+        "items": n, "storage": storage,
+        "representation": "compact" if database._store().compact_items else "dict",
+        "load_s": round(loaded - start, 3),
+        "rss_mb": round(loaded_rss - baseline, 1),
+        "index_s": round(time.perf_counter() - loaded, 3),
+        "index_rss_mb": round(current_rss_mb() - loaded_rss, 1),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def memory_comparison(n, storage="json", seed=42):
+    """Runs load_footprint once per item representation, each in a fresh
+    process (BOOKHAVEN_ITEMS=dict|compact)."""
+    result = {"items": n, "storage": storage}
+    for representation in ("dict", "compact"):
+        cmd = [sys.executable, os.path.abspath(__file__), "--memory-child", "--items", str(n),
+               "--storage", storage, "--seed", str(seed)]
+        env = dict(os.environ, BOOKHAVEN_ITEMS=representation)
+        out = subprocess.run(cmd, capture_output=True, text=True, env=env, check=True)
+        result[representation] = json.loads(out.stdout)
+    before, after = result["dict"]["rss_mb"], result["compact"]["rss_mb"]
+    result["rss_saving_pct"] = round(100 * (before - after) / before, 1) if before else None
+    return result
+
+
+# --- SINGLE-CALL TIMINGS ---
+def timeit(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def run(n, repeat, storage="json"):
+    prepare(n, storage)
+
+    def cold(fn):
+        # The old behaviour: every call parsed the whole file again.
+        def call():
+            database.invalidate_cache()
+            fn()
+        return call
+
+    cases = {
+        "get_item": lambda: database.get_item(random.randint(1, n)),
+        "list_by_category": lambda: database.list_by_category("Film"),
+        "filter_available_films": lambda: database.filter_page({"category": "Film", "status": "Available"}),
+        "search_smart": lambda: database.search_smart("ocean"),
+        "search_substring": lambda: database.search_smart("ocean", "substring"),
+    }
+    results = {"items": n, "storage": storage}
+    database.list_all()  # warm-up
+    for name, fn in cases.items():
+        results[name] = {
+            "cold_ms": round(timeit(cold(fn), max(1, repeat // 10)), 3),
+            "resident_ms": round(timeit(fn, repeat), 3),
+        }
+    return results
+
+
+# --- MIXED WORKLOAD ---
+# Each operation is a function (rnd, n) -> None, run against either the
+# database API or the Flask app. Conflicts (borrowing an item that is out,
+# saving over a newer version) are normal traffic, not errors.
+DEFAULT_MIX = {"browse": 30, "filter": 5, "search": 25, "borrow": 10, "return": 10, "edit": 10, "stats": 10}
+QUERIES = [w.lower() for w in WORDS] + [n.lower() for n in LAST_NAMES] + ["ocean night", "murakmi", "sec"]
+
+
+def _browse_args(rnd, n):
+    category = rnd.choice([None, None] + CATEGORIES)
+    sort = rnd.choice([None, "name", "-publication_date", "author", "status"])
+    return category, sort, rnd.randrange(0, max(1, n // (2 if category else 1) - 50))
+
+
+def _filter_args(rnd, author_of):
+    """A combined filter, e.g. available films; half of them also name the
+    author of a random item (author_of(item_id), so popular authors come up
+    more often)."""
+    filters = {"category": rnd.choice(CATEGORIES), "status": rnd.choice(["Available", "Checked Out"])}
+    if rnd.random() < 0.5:
+        filters["author"] = author_of()
+    return filters
+
+
+def api_ops():
+    def browse(rnd, n):
+        category, sort, offset = _browse_args(rnd, n)
+        database.list_page(category, sort, offset, 50)
+
+    def filter_(rnd, n):
+        filters = _filter_args(rnd, lambda: database.get_item(rnd.randint(1, n))["author"])
+        database.filter_page(filters, None, 0, 50)
+
+    def search(rnd, n):
+        database.search_page(rnd.choice(QUERIES), "smart", None, 0, 50)
+
+    def borrow(rnd, n):
+        try:
+            database.set_status(rnd.randint(1, n), "Checked Out", TODAY.isoformat(), "Bench Patron",
+                                expected_status="Available")
+        except database.VersionConflict:
+            pass
+
+    def give_back(rnd, n):
+        database.set_status(rnd.randint(1, n), "Available", None, None)
+
+    def edit(rnd, n):
+        item = database.get_item(rnd.randint(1, n))
+        try:
+            database.update_item(item["id"], item["name"] + "!", item["publication_date"], item["author"],
+                                 item["category"], expected_version=item["version"])
+        except database.VersionConflict:
+            pass
+
+    def stats(rnd, n):
+        database.stats()
+        database.overdue_count(TODAY)
+
+    return {"browse": browse, "filter": filter_, "search": search, "borrow": borrow, "return": give_back, "edit": edit, "stats": stats}
+
+
+def http_ops(client):
+    def get(url):
+        resp = client.get(url)
+        resp.get_data()
+        resp.close()
+        if resp.status_code >= 400:
+            raise RuntimeError(f"GET {url} -> {resp.status_code}")
+        return resp
+
+    def browse(rnd, n):
+        category, sort, offset = _browse_args(rnd, n)
+        base = f"/media/category/{category}" if category else "/media"
+        get(f"{base}?offset={offset}&limit=50" + (f"&sort={sort}" if sort else ""))
+
+    def filter_(rnd, n):
+        filters = _filter_args(rnd, lambda: get(f"/media/{rnd.randint(1, n)}").get_json()["author"])
+        get(f"/media?{urllib.parse.urlencode(filters)}&limit=50")
+
+    def search(rnd, n):
+        get(f"/media/search?name={rnd.choice(QUERIES)}&limit=50")
+
+    def borrow(rnd, n):
+        resp = client.post(f"/media/{rnd.randint(1, n)}/borrow",
+                           json={"borrower": "Bench Patron", "borrow_date": TODAY.isoformat()})
+        if resp.status_code not in (200, 409):
+            raise RuntimeError(f"borrow -> {resp.status_code}")
+
+    def give_back(rnd, n):
+        resp = client.post(f"/media/{rnd.randint(1, n)}/return")
+        if resp.status_code != 200:
+            raise RuntimeError(f"return -> {resp.status_code}")
+
+    def edit(rnd, n):
+        item = get(f"/media/{rnd.randint(1, n)}").get_json()
+        resp = client.put(f"/media/{item['id']}", json=dict(item, name=item["name"] + "!"))
+        if resp.status_code not in (200, 409):
+            raise RuntimeError(f"edit -> {resp.status_code}")
+
+    def stats(rnd, n):
+        get(f"/stats?breakdown=overdue&as_of={TODAY.isoformat()}")
+
+    return {"browse": browse, "filter": filter_, "search": search, "borrow": borrow, "return": give_back, "edit": edit, "stats": stats}
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def workload(n, storage="json", target="api", threads=4, ops=10000, mix=None, seed=42):
+    """Runs `ops` operations drawn from `mix` on `threads` threads and
+    returns the JSON-ready report."""
+    mix = mix or DEFAULT_MIX
+    start = time.perf_counter()
+    prepare(n, storage, seed)
+    if target == "http":
+        import backend
+        app = backend.create_app()
+        make_ops = lambda: http_ops(app.test_client())
+    else:
+        database.warm_up()
+        make_ops = api_ops
+    setup_s = time.perf_counter() - start
+
+    names = list(mix)
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    per_thread = [ops // threads + (1 if i < ops % threads else 0) for i in range(threads)]
+    barrier = threading.Barrier(threads + 1)
+    lock = threading.Lock()
+
+    def worker(index, count):
+        rnd = random.Random(seed * 1000 + index)
+        plan = rnd.choices(names, [mix[name] for name in names], k=count)
+        ops_by_name = make_ops()
+        local = {name: [] for name in names}
+        failed = {name: 0 for name in names}
+        barrier.wait()
+        for name in plan:
+            t = time.perf_counter()
+            try:
+                ops_by_name[name](rnd, n)
+            except Exception:
+                failed[name] += 1
+            local[name].append(time.perf_counter() - t)
+        with lock:
+            for name in names:
+                latencies[name].extend(local[name])
+                errors[name] += failed[name]
+
+    workers = [threading.Thread(target=worker, args=(i, c)) for i, c in enumerate(per_thread)]
+    for w in workers:
+        w.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for w in workers:
+        w.join()
+    duration = time.perf_counter() - start
+
+    report = {
+        "items": n, "storage": storage, "target": target, "threads": threads, "ops": ops, "seed": seed,
+        "mix": mix, "setup_s": round(setup_s, 3), "duration_s": round(duration, 3),
+        "throughput_ops_s": round(ops / duration, 1), "operations": {},
+    }
+    everything = []
+    for name in names:
+        values = sorted(latencies[name])
+        everything.extend(values)
+        report["operations"][name] = _summary(values, errors[name])
+    everything.sort()
+    report["overall"] = _summary(everything, sum(errors.values()))
+    report["peak_rss_mb"] = peak_rss_mb()
+    report["python"] = platform.python_version()
+    return report
+
+
+def _summary(sorted_values, error_count):
+    ms = lambda s: None if s is None else round(s * 1000, 3)
+    return {
+        "count": len(sorted_values),
+        "errors": error_count,
+        "p50_ms": ms(_percentile(sorted_values, 0.50)),
+        "p99_ms": ms(_percentile(sorted_values, 0.99)),
+        "mean_ms": ms(sum(sorted_values) / len(sorted_values)) if sorted_values else None,
+    }
+
+
+# --- SUITE & REGRESSION CHECK ---
+def suite(sizes, storages, targets, threads, ops, seed):
+    """Runs every combination in its own process, so peak RSS and caches
+    of one run don't leak into the next."""
+    runs = []
+    for n in sizes:
+        for storage in storages:
+            for target in targets:
+                cmd = [sys.executable, os.path.abspath(__file__), "--workload", "--items", str(n),
+                       "--storage", storage, "--target", target, "--threads", str(threads),
+                       "--ops", str(ops), "--seed", str(seed)]
+                print(f"{n} items, {storage}, {target}...", file=sys.stderr)
+                out = subprocess.run(cmd, capture_output=True, text=True)
+                if out.returncode != 0:
+                    runs.append({"items": n, "storage": storage, "target": target, "failed": out.stderr[-2000:]})
+                else:
+                    runs.append(json.loads(out.stdout))
+    return {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "platform": platform.platform(), "runs": runs}
+
+
+def compare(report, baseline, tolerance):
+    """Lists runs (of a suite or single workload report) whose throughput dropped or p99 rose by more than
+    `tolerance` (0.2 = 20%) against the matching baseline run."""
+    key = lambda r: (r["items"], r["storage"], r["target"], r.get("threads"))
+    old = {key(r): r for r in baseline.get("runs", [baseline]) if "failed" not in r}
+    regressions = []
+    for run_ in report.get("runs", [report]):
+        before = old.get(key(run_))
+        if before is None or "failed" in run_:
+            continue
+        if run_["throughput_ops_s"] < before["throughput_ops_s"] * (1 - tolerance):
+            regressions.append(f"{key(run_)}: throughput {before['throughput_ops_s']} -> {run_['throughput_ops_s']} ops/s")
+        for name, stats in run_["operations"].items():
+            was = before["operations"].get(name, {}).get("p99_ms")
+            if was and stats["p99_ms"] and stats["p99_ms"] > was * (1 + tolerance):
+                regressions.append(f"{key(run_)} {name}: p99 {was} -> {stats['p99_ms']} ms")
+    return regressions
+
+
+def _mix_arg(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r}; choose from {list(DEFAULT_MIX)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Book Haven store")
+    parser.add_argument("--items", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--storage", choices=["json", "wal", "sqlite"], default="json")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workload", action="store_true", help="run the mixed workload instead of single calls")
+    parser.add_argument("--target", choices=["api", "http"], default="api")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--ops", type=int, default=10000)
+    parser.add_argument("--mix", type=_mix_arg, help="e.g. browse=50,search=30,borrow=20")
+    parser.add_argument("--suite", action="store_true", help="run the workload over several sizes/backends/targets")
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--storages", default="json,wal,sqlite")
+    parser.add_argument("--targets", default="api,http")
+    parser.add_argument("--out", help="also write the JSON report here")
+    parser.add_argument("--compare", metavar="BASELINE", help="suite report to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--write-catalog", metavar="PATH", help="only write a synthetic media_store.json")
+    parser.add_argument("--memory", action="store_true", help="compare memory of compact records and dicts")
+    parser.add_argument("--memory-child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.write_catalog:
+        write_catalog(args.write_catalog, args.items, args.seed)
+        sys.exit(0)
+    if args.memory_child:
+        print(json.dumps(load_footprint(args.items, args.storage, args.seed)))
+        sys.exit(0)
+    if args.memory:
+        result = memory_comparison(args.items, args.storage, args.seed)
+    elif args.suite:
+        result = suite([int(s) for s in args.sizes.split(",")], args.storages.split(","),
+                       args.targets.split(","), args.threads, args.ops, args.seed)
+    elif args.workload:
+        result = workload(args.items, args.storage, args.target, args.threads, args.ops, args.mix, args.seed)
+    else:
+        result = run(args.items, args.repeat, args.storage)
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line, file=sys.stderr)
+        sys.exit(1 if regressions else 0)
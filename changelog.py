@@ -0,0 +1,45 @@
+"""Recent-changes log behind GET /media/changes.
+
+Remembers which item ids each store revision touched, for the last
+`max_entries` changes. Clients that fell further behind than that (or that
+last synced before this process loaded the store) are told to reload.
+"""
+import threading
+from collections import deque
+
+
+class ChangeLog:
+    def __init__(self, max_entries=50000):
+        self._entries = deque(maxlen=max_entries)   # (revision, item_id)
+        self._lock = threading.Lock()
+        self.floor = None        # oldest revision we can answer "since" for
+        self.latest = None
+
+    def reset(self, revision):
+        """Forgets everything; only changes after `revision` will be known."""
+        with self._lock:
+            self._entries.clear()
+            self.floor = self.latest = revision
+
+    def record(self, revision, item_ids):
+        with self._lock:
+            if self.floor is None:
+                return
+            for item_id in item_ids:
+                if len(self._entries) == self._entries.maxlen:
+                    self.floor = self._entries[0][0]
+                self._entries.append((revision, item_id))
+            self.latest = revision
+
+    def since(self, revision):
+        """Returns (ids changed after `revision`, latest revision), or
+        (None, latest) if that history is no longer available."""
+        with self._lock:
+            if self.floor is None or not self.floor <= revision <= self.latest:
+                return None, self.latest
+            ids = {}
+            for rev, item_id in reversed(self._entries):
+                if rev <= revision:
+                    break
+                ids.setdefault(item_id, rev)
+            return sorted(ids, key=ids.get), self.latest
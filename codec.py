@@ -0,0 +1,175 @@
+"""JSON encoding and decoding for the store files and the HTTP responses.
+
+Uses orjson when it is installed (pip install orjson), otherwise the
+standard library; both produce the same compact JSON, and both write
+records.Item values as plain objects.
+
+The store snapshot (media_store.json) is written one item per line:
+
+    {"bookhaven":2,"next_id":3,"revision":7,
+    "loans":[
+    {"seq":1,"type":"open",...}
+    ],
+    "items":{
+    "1":{"id":1,"name":"Dune",...},
+    "2":{"id":2,...}
+    }}
+
+It is still one ordinary JSON document, but read_snapshot() reads it a
+line at a time, so loading a large store never holds the whole file (or a
+parsed copy of it) in memory. Older indented snapshots are read whole.
+
+With BOOKHAVEN_VALIDATE=1, every item read from a snapshot is checked
+against ITEM_TYPES and a bad one stops the load with a ValidationError.
+"""
+import json
+import os
+
+import records
+
+try:
+    import orjson
+except ImportError:   # optional dependency
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+SNAPSHOT_FORMAT = 2
+VALIDATE = os.environ.get("BOOKHAVEN_VALIDATE", "") not in ("", "0")
+
+ITEM_TYPES = {
+    "id": (int,),
+    "name": (str,),
+    "publication_date": (str, int, type(None)),
+    "author": (str, type(None)),
+    "category": (str,),
+    "status": (str,),
+    "borrow_date": (str, type(None)),
+    "borrower": (str, type(None)),
+    "version": (int,),
+}
+STATUSES = ("Available", "Checked Out")
+
+
+class ValidationError(ValueError):
+    pass
+
+
+# --- VALUES ---
+if orjson is not None:
+    _OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj, default=records.json_default):
+        """Compact JSON as bytes; default(obj) handles other types."""
+        return orjson.dumps(obj, default=default, option=_OPTIONS)
+
+    def loads(data):
+        return orjson.loads(data)
+else:
+    _encoder = json.JSONEncoder(separators=(",", ":"), default=records.json_default)
+
+    def dumps(obj, default=records.json_default):
+        """Compact JSON as bytes; default(obj) handles other types."""
+        if default is not records.json_default:
+            return json.dumps(obj, separators=(",", ":"), default=default).encode("utf-8")
+        return _encoder.encode(obj).encode("utf-8")
+
+    def loads(data):
+        return json.loads(data)
+
+
+def dumps_str(obj, default=records.json_default):
+    return dumps(obj, default).decode("utf-8")
+
+
+def validate_item(item):
+    """Raises ValidationError unless `item` has the fields and types of a
+    catalog item (fields that are absent are allowed, as in older stores)."""
+    if not isinstance(item, dict) or "id" not in item:
+        raise ValidationError(f"Not an item: {item!r}")
+    try:
+        check_fields(item)
+    except ValidationError as e:
+        raise ValidationError(f"Item {item['id']}: {e}") from None
+    return item
+
+
+def check_fields(fields):
+    """Raises ValidationError if any item field present in `fields` has the
+    wrong type (or status value). Used for new and edited items, too."""
+    for field, types in ITEM_TYPES.items():
+        if field in fields and not isinstance(fields[field], types):
+            raise ValidationError(f"'{field}' has type {type(fields[field]).__name__}")
+        if field in fields and types[0] is int and isinstance(fields[field], bool):
+            raise ValidationError(f"'{field}' has type bool")
+    if fields.get("status", "Available") not in STATUSES:
+        raise ValidationError(f"unknown status {fields['status']!r}")
+
+
+# --- STORE SNAPSHOT ---
+def write_snapshot(f, data, items=None):
+    """Writes the store dict to binary file `f` in the line-per-item format.
+    `items` (an iterable, e.g. a generator) replaces data["items"].
+    Returns the number of bytes written."""
+    meta = {k: v for k, v in data.items() if k not in ("items", "loans")}
+    written = f.write(dumps({"bookhaven": SNAPSHOT_FORMAT, **meta})[:-1] + b',\n"loans":[\n')
+    written += _write_lines(f, (dumps(event) for event in data.get("loans", ())))
+    written += f.write(b'],\n"items":{\n')
+    items = data["items"].values() if items is None else items
+    written += _write_lines(f, (b'"%d":' % item["id"] + dumps(item) for item in items))
+    written += f.write(b"}}\n")
+    return written
+
+
+def _write_lines(f, lines):
+    written = 0
+    first = True
+    for line in lines:
+        written += f.write(line if first else b",\n" + line)
+        first = False
+    if not first:
+        written += f.write(b"\n")
+    return written
+
+
+def read_snapshot(f, item_hook=None):
+    """Reads a store written by write_snapshot (or any older JSON snapshot)
+    from binary file `f`. item_hook(dict) turns each item into what the
+    store keeps in memory. Returns (data, bytes read)."""
+    first = f.readline()
+    if not first.startswith(b'{"bookhaven":'):
+        body = first + f.read()
+        if item_hook is None and not VALIDATE:
+            return loads(body), len(body)
+
+        def hook(obj):
+            return _item(obj, item_hook) if "id" in obj and "category" in obj else obj
+        return json.loads(body, object_hook=hook), len(body)
+    data = loads(first.rstrip().rstrip(b",") + b"}")
+    if data.pop("bookhaven") > SNAPSHOT_FORMAT:
+        raise ValueError("Store was written by a newer version")
+    data["loans"], data["items"] = [], {}
+    size = len(first)
+    section = end = None
+    for line in f:
+        size += len(line)
+        line = line.rstrip()
+        if line in (b'"loans":[', b'"items":{'):
+            section = line[1:6]
+        elif line in (b"],", b"}}"):
+            section, end = None, line
+        elif section == b"loans":
+            data["loans"].append(loads(line.rstrip(b",")))
+        elif section == b"items":
+            key, _, body = line.rstrip(b",").partition(b":")
+            data["items"][int(key[1:-1])] = _item(loads(body), item_hook)
+        elif line:
+            raise json.JSONDecodeError("Unexpected line in store file", line.decode("utf-8", "replace"), 0)
+    if end != b"}}":
+        raise json.JSONDecodeError("Store file is truncated", "", size)
+    return data, size
+
+
+def _item(obj, item_hook):
+    if VALIDATE:
+        validate_item(obj)
+    return item_hook(obj) if item_hook else obj
@@ -0,0 +1,84 @@
+"""Running totals behind /stats.
+
+database.py feeds every committed change into CatalogCounters.apply(), so
+the totals are always current without scanning the catalog. verify() in
+database.py rebuilds a fresh copy from the store to detect drift.
+"""
+import bisect
+import threading
+from collections import Counter
+from datetime import date, timedelta
+
+
+def _loan_date(item):
+    """The item's borrow_date as an ISO string, or None if it isn't one."""
+    value = item.get("borrow_date")
+    try:
+        return date.fromisoformat(value).isoformat() if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+class CatalogCounters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.total = 0
+        self.by_category = Counter()
+        self.by_status = Counter()
+        self.by_borrower = Counter()
+        self._loan_dates = []  # sorted borrow dates of checked-out items
+
+    def rebuild(self, items):
+        with self._lock:
+            self.clear()
+            for item in items:
+                self._count(item, 1)
+
+    def apply(self, old, new):
+        """Moves one item from its old state to its new one (either may be None)."""
+        with self._lock:
+            if old is not None:
+                self._count(old, -1)
+            if new is not None:
+                self._count(new, 1)
+
+    def _count(self, item, sign):
+        self.total += sign
+        _bump(self.by_category, item.get("category"), sign)
+        _bump(self.by_status, item.get("status"), sign)
+        if item.get("status") == "Checked Out":
+            _bump(self.by_borrower, item.get("borrower"), sign)
+            loan_date = _loan_date(item)
+            if loan_date is None:
+                return
+            if sign > 0:
+                bisect.insort(self._loan_dates, loan_date)
+            else:
+                i = bisect.bisect_left(self._loan_dates, loan_date)
+                if i < len(self._loan_dates) and self._loan_dates[i] == loan_date:
+                    del self._loan_dates[i]
+
+    def overdue(self, as_of, loan_days):
+        """Checked-out items borrowed more than `loan_days` before `as_of`."""
+        cutoff = (as_of - timedelta(days=loan_days)).isoformat()
+        with self._lock:
+            return bisect.bisect_left(self._loan_dates, cutoff)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "total": self.total,
+                "by_category": dict(self.by_category),
+                "by_status": dict(self.by_status),
+                "by_borrower": dict(self.by_borrower),
+                "loan_dates": len(self._loan_dates),
+            }
+
+
+def _bump(counter, key, sign):
+    counter[key] += sign
+    if counter[key] == 0:
+        del counter[key]
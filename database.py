@@ -1,117 +1,564 @@
-import json
+import itertools
 import os
 import threading
+from datetime import date
+from contextlib import contextmanager
+
+import codec
+import metrics
+from changelog import ChangeLog
+from counters import CatalogCounters
+from events import EventHub
+from filter_index import FilterIndex
+from json_store import JsonStore, sort_key
+from loans import LoanLedger, events_for
+from search_index import SearchIndex
+from sqlite_store import SqliteStore
 
 # --- AUTOMATIC PATH FIX ---
 # This ensures the file is created in the EXACT same folder as this script
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 STORE_FILE = os.path.join(BASE_DIR, "media_store.json")
+SQLITE_FILE = os.path.join(BASE_DIR, "media_store.db")
 
-_LOCK = threading.Lock()
 ALLOWED_CATEGORIES = ["Book", "Film", "Magazine"]
+LOAN_PERIOD_DAYS = int(os.environ.get("BOOKHAVEN_LOAN_DAYS", "14"))
 
-def _init_store():
-    """Creates the file if it doesn't exist OR if it is empty/corrupted."""
-    should_create = False
-    
-    # Check 1: Does file exist?
-    if not os.path.exists(STORE_FILE):
-        should_create = True
-    else:
-        # Check 2: Is file empty? (0 bytes)
-        if os.path.getsize(STORE_FILE) == 0:
-            should_create = True
+# --- STORAGE BACKEND ---
+# "json":   every change rewrites media_store.json (atomically).
+# "wal":    every change appends one line to media_store.json.log; a background
+#           thread folds the log back into the snapshot once it grows large.
+# "sqlite": indexed SQLite database in media_store.db
+#           (migrate with: python sqlite_store.py media_store.json media_store.db)
+STORAGE = os.environ.get("BOOKHAVEN_STORAGE", "json")
+
+_STORE = {"backend": None}
+
+def _timed(fn):
+    """Records each call's duration in bookhaven_database_call_seconds."""
+    return metrics.timed_call("bookhaven_database_call_seconds", function=fn.__name__)(fn)
 
-    if should_create:
-        with open(STORE_FILE, "w", encoding="utf-8") as f:
-            json.dump({"next_id": 1, "items": {}}, f, indent=2)
+def configure(storage=None, path=None):
+    """Switches the storage backend (and optionally its file) at runtime."""
+    global STORAGE, STORE_FILE, SQLITE_FILE
+    old = _STORE["backend"]
+    if old is not None:
+        old.close()
+    STORAGE = storage or STORAGE
+    if path and STORAGE == "sqlite":
+        SQLITE_FILE = path
+    elif path:
+        STORE_FILE = path
+    _STORE["backend"] = None
+    _DERIVED["key"] = None
+    return _store()
 
-def _load():
-    """Safe load function that handles corrupted files."""
+def _store():
+    store = _STORE["backend"]
+    if store is None:
+        if STORAGE == "sqlite":
+            store = SqliteStore(SQLITE_FILE)
+        elif STORAGE in ("json", "wal"):
+            store = JsonStore(STORE_FILE, mode=STORAGE)
+        else:
+            raise ValueError(f"Unknown storage backend: {STORAGE}")
+        _STORE["backend"] = store
+    return store
+
+def _init_store():
+    """Opens the configured store (creating the file if needed)."""
+    _store().load()
+
+def warm_up():
+    """Opens the store and builds the in-memory indexes, so the first
+    request after startup doesn't pay for loading the catalog."""
     _init_store()
-    with _LOCK:
-        with open(STORE_FILE, "r", encoding="utf-8") as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError:
-                return {"next_id": 1, "items": {}}
+    _ensure_derived()
 
-def _save(data):
-    with _LOCK:
-        with open(STORE_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2)
+def invalidate_cache():
+    """Forces the next read to go back to disk."""
+    _store().invalidate()
+
+def store_size():
+    """Bytes the store occupies on disk (snapshot plus log or WAL files)."""
+    return _store().disk_size()
+
+def compact():
+    """Folds the write-ahead log into the snapshot (wal mode only)."""
+    store = _store()
+    return store.compact() if hasattr(store, "compact") else False
 
 def list_all():
-    data = _load()
-    return list(data["items"].values())
+    return _store().all()
 
 def list_by_category(category):
-    return [m for m in list_all() if m["category"] == category]
+    return list(filter_items({"category": category}))
+
+# --- SORTED PAGES (random access for the desktop app's virtual list) ---
+SORT_FIELDS = ["id", "name", "author", "category", "publication_date", "status"]
+
+def _parse_sort(sort):
+    """"name" -> ("name", False), "-name" -> ("name", True)."""
+    if not sort:
+        return "id", False
+    field = sort.lstrip("-")
+    if field not in SORT_FIELDS:
+        raise ValueError(f"Unknown sort field. Allowed: {SORT_FIELDS}")
+    return field, sort.startswith("-")
+
+@_timed
+def list_page(category=None, sort=None, offset=0, limit=50):
+    """Returns (total, items) for one page of the catalog in `sort` order."""
+    field, descending = _parse_sort(sort)
+    if category is not None and field == "id":
+        return filter_page({"category": category}, sort, offset, limit)
+    counts = stats()
+    total = counts["total"] if category is None else counts["by_category"].get(category, 0)
+    return total, _store().page(category, field, descending, offset, limit)
+
+@_timed
+def search_page(query, mode="smart", sort=None, offset=0, limit=50):
+    """Returns (total, items) for one page of search results, ranked by
+    relevance unless `sort` is given."""
+    field, descending = _parse_sort(sort)
+    if not query.strip():
+        return list_page(None, sort, offset, limit)
+    _ensure_derived()
+    store = _store()
+    if not sort:
+        # Only the best offset + limit matches are picked, not all of them sorted
+        total, ids = _SEARCH.ranked(query, mode, offset + limit)
+        return total, [m for m in store.get_many(ids[offset:]) if m is not None]
+    ids = _SEARCH.search(query, mode)
+    items = sorted((m for m in store.get_many(ids) if m is not None), key=sort_key(field), reverse=descending)
+    return len(ids), items[offset:offset + limit]
+
+def iter_items(category=None, after_id=0):
+    """Yields items (optionally of one category) in id order after `after_id`,
+    without building the whole list."""
+    return _store().iter_items(category, after_id)
+
+# --- FILTERS (category/status/author secondary indexes, see filter_index.py) ---
+FILTER_FIELDS = ("category", "status", "author")
 
-# --- SMART SEARCH (Partial Match) ---
-def search_smart(query):
+@_timed
+def filter_items(filters, after_id=0):
+    """Yields the items whose fields equal every value in `filters` (a
+    {field: value} dict over FILTER_FIELDS), in id order after `after_id`."""
+    _ensure_derived()
+    ids = _FILTERS.ids(filters, after_id)
+    store = _store()
+    return (item for item in store.get_many(ids) if item is not None)
+
+@_timed
+def filter_page(filters, sort=None, offset=0, limit=50):
+    """Returns (total, items) for one page of filtered items in `sort` order.
+    Only the matching items are sorted, never the whole catalog."""
+    field, descending = _parse_sort(sort)
+    _ensure_derived()
+    ids = _FILTERS.ids(filters)
+    store = _store()
+    if field == "id":
+        end = len(ids) - offset
+        page = ids[max(0, end - limit):max(0, end)][::-1] if descending else ids[offset:offset + limit]
+        return len(ids), [m for m in store.get_many(page) if m is not None]
+    items = sorted((m for m in store.get_many(ids) if m is not None), key=sort_key(field), reverse=descending)
+    return len(ids), items[offset:offset + limit]
+
+# --- DERIVED INDEXES ---
+# In-memory structures built from the catalog. They are patched on every
+# change made through transaction(), and with the changes other server
+# processes appended to the wal log or the SQLite change feed (see
+# _catch_up). They are only rebuilt from scratch when the store moved on in
+# a way we can't replay: it was reloaded from disk, the change feed was
+# pruned past our last look, or a commit failed. _DERIVED["key"] is the
+# (generation, revision) they reflect.
+_SEARCH = SearchIndex()
+_COUNTERS = CatalogCounters()
+_CHANGES = ChangeLog()
+_LOANS = LoanLedger()
+_FILTERS = FilterIndex(FILTER_FIELDS)
+_EVENTS = EventHub(int(os.environ.get("BOOKHAVEN_EVENT_BUFFER", "256")))
+_DERIVED = {"key": None}
+
+def _derived_key(store):
+    return store.generation(), store.revision()
+
+def _ensure_derived():
+    store = _store()
+    if _DERIVED["key"] == _derived_key(store):
+        return
+    # A read snapshot, not a write transaction: other processes keep
+    # committing while we catch up or rebuild
+    with store.snapshot():
+        _catch_up(store)
+        key = _derived_key(store)
+        if _DERIVED["key"] != key:
+            with metrics.timed("bookhaven_store_seconds", op="rebuild_indexes"):
+                _SEARCH.rebuild(store.iter_items())
+                _COUNTERS.rebuild(store.iter_items())
+                _FILTERS.rebuild(store.iter_items())
+                _LOANS.rebuild(store.iter_loans(), store.iter_items(), LOAN_PERIOD_DAYS)
+            _CHANGES.reset(store.revision())
+            _DERIVED["key"] = key
+            _publish(store.revision(), None)
+
+def _catch_up(store):
+    """Applies what other processes committed (wal log tail, SQLite change
+    feed) since we last looked, keeping the indexes current without a
+    rebuild."""
+    changes = store.take_foreign_changes()
+    if not changes or _DERIVED["key"] is None:
+        return
+    for old, new in changes:
+        _changed(old, new)
+    _LOANS.extend(store.iter_loans(_LOANS.seq))
+    generation, revision = _derived_key(store)
+    ids = [(new or old)["id"] for old, new in changes]
+    _CHANGES.record(revision, ids)
+    if _DERIVED["key"][0] == generation:
+        _DERIVED["key"] = (generation, revision)
+    _publish(revision, ids)
+
+def _changed(old, new):
+    """Applies one committed change to the indexes."""
+    if _DERIVED["key"] is None:
+        return
+    _COUNTERS.apply(old, new)
+    _FILTERS.apply(old, new)
+    if new is None:
+        _SEARCH.remove(old["id"])
+    elif old is None or old.get("name") != new.get("name") or old.get("author") != new.get("author"):
+        _SEARCH.add(new)
+
+# --- SMART SEARCH (Ranked, via the inverted index) ---
+@_timed
+def search_smart(query, mode="smart"):
+    """Searches name AND author. `mode` is one of search_index.MODES;
+    "substring" keeps the original partial-match behaviour."""
+    return list(iter_search(query, mode))
+
+@_timed
+def iter_search(query, mode="smart", offset=0, limit=None):
+    """Like search_smart, but yields results lazily starting at `offset`
+    (at most `limit` of them). Raises ValueError for an unknown mode before
+    anything is yielded."""
     query = query.lower().strip()
-    if not query: return list_all()
-    # Searches in Name AND Author for better results
-    return [m for m in list_all() if query in m["name"].lower() or query in m.get("author", "").lower()]
+    end = None if limit is None else offset + limit
+    if not query: return itertools.islice(iter_items(), offset, end)
+    _ensure_derived()
+    ids = _SEARCH.search(query, mode, end)
+    store = _store()
+    return (item for item in store.get_many(itertools.islice(ids, offset, None)) if item is not None)
 
+@_timed
 def search_exact(name):
-    return [m for m in list_all() if m["name"] == name]
+    return _store().by_name(name)
 
+@_timed
 def get_item(item_id):
-    data = _load()
-    return data["items"].get(str(item_id))
+    return _store().get(item_id)
 
-def create_item(name, publication_date, author, category):
+# --- STATS (kept up to date on every change, see counters.py) ---
+@_timed
+def stats():
+    """Totals per category, status and borrower, without scanning the catalog."""
+    _ensure_derived()
+    return _COUNTERS.snapshot()
+
+@_timed
+def overdue_count(as_of=None):
+    """Number of items checked out for longer than LOAN_PERIOD_DAYS."""
+    _ensure_derived()
+    return _COUNTERS.overdue(as_of or date.today(), LOAN_PERIOD_DAYS)
+
+@_timed
+def verify_stats(repair=False):
+    """Recounts everything from the store and compares it with the running
+    totals. Returns {"ok": bool, "expected": ..., "actual": ...}; with
+    `repair`, the running totals are replaced by the fresh count."""
+    _ensure_derived()
+    with transaction() as store:
+        fresh = CatalogCounters()
+        fresh.rebuild(store.iter_items())
+        expected, actual = fresh.snapshot(), _COUNTERS.snapshot()
+        if repair and expected != actual:
+            _COUNTERS.rebuild(store.iter_items())
+    return {"ok": expected == actual, "expected": expected, "actual": actual}
+
+# --- LOAN LEDGER (every check-out and return, see loans.py) ---
+@_timed
+def patron_loans(borrower, history=False):
+    """What `borrower` has out now, or with `history` every loan event of
+    theirs, oldest first."""
+    _ensure_derived()
+    return _LOANS.patron_history(borrower) if history else _LOANS.loans_of(borrower)
+
+@_timed
+def overdue_loans(as_of=None, limit=None):
+    """Open loans due before `as_of` (default today), most overdue first."""
+    _ensure_derived()
+    return _LOANS.overdue(as_of or date.today(), limit)
+
+@_timed
+def item_history(item_id):
+    """Loan events of one item, oldest first (kept after it is deleted)."""
+    _ensure_derived()
+    return _LOANS.history(int(item_id))
+
+# --- TRANSACTIONS ---
+# Mutations hold the store from the read to the commit, so two requests can
+# no longer both load, both change state, and have one overwrite the other.
+# Items are replaced rather than edited in place, so a reader that is still
+# serializing the old dict never sees half an update.
+class VersionConflict(Exception):
+    """Raised when a change was based on a stale copy of an item."""
+
+    def __init__(self, item, message="Item was changed by someone else"):
+        super().__init__(message)
+        self.item = item
+
+class _Txn:
+    """Store handle yielded by transaction(); every put/delete also updates
+    the derived indexes."""
+
+    def __init__(self, store):
+        self._store = store
+        self.dirty = False
+        self.touched = []
+
+    def __getattr__(self, name):
+        return getattr(self._store, name)
+
+    def put(self, item):
+        old = self._store.get(item["id"])
+        self._store.put(item)
+        self.dirty = True
+        self.touched.append(item["id"])
+        self._record_loans(old, item)
+        _changed(old, item)
+
+    def delete(self, item_id):
+        old = self._store.get(item_id)
+        if old is None:
+            return False
+        self._store.delete(item_id)
+        self.dirty = True
+        self.touched.append(old["id"])
+        self._record_loans(old, None)
+        _changed(old, None)
+        return True
+
+    def _record_loans(self, old, new):
+        for event in events_for(old, new, LOAN_PERIOD_DAYS):
+            event = self._store.append_loan(event)
+            if _DERIVED["key"] is not None:
+                _LOANS.apply(event)
+
+_CURRENT = threading.local()
+
+@contextmanager
+def transaction():
+    """Holds the store for a whole read-modify-write:
+
+        with database.transaction() as store:
+            item = store.get(item_id)
+            store.put(...)
+
+    Nested calls join the outer transaction. A transaction that changed
+    anything advances the store revision by one when it commits.
+    """
+    txn = getattr(_CURRENT, "txn", None)
+    if txn is not None:
+        yield txn
+        return
+    committed = None
+    try:
+        with _store().transaction() as store:
+            _catch_up(store)
+            txn = _CURRENT.txn = _Txn(store)
+            yield txn
+            if txn.dirty:
+                key = _derived_key(store)
+                revision = store.bump_revision()
+                _CHANGES.record(revision, txn.touched)
+                if _DERIVED["key"] == key:
+                    _DERIVED["key"] = (key[0], revision)
+                committed = revision
+    except BaseException:
+        if txn is not None and txn.dirty:
+            _DERIVED["key"] = None   # rolled back: rebuild on next use
+        raise
+    finally:
+        _CURRENT.txn = None
+    if committed is not None:
+        _publish(committed, txn.touched)
+
+def revision():
+    """Store revision: goes up by one with every committed change."""
+    return _store().revision()
+
+@_timed
+def changes_since(since):
+    """Items changed after revision `since`, for clients that keep a local
+    copy. Returns (revision, changes) where each change is
+    {"op": "put", "item": {...}} or {"op": "del", "id": n}; changes is None
+    when that history is gone and the client must reload everything."""
+    _ensure_derived()
+    ids, latest = _CHANGES.since(since)
+    if ids is None:
+        return revision(), None
+    return latest, _describe(_store(), ids)
+
+def _describe(store, ids):
+    return [{"op": "put", "item": item} if item is not None else {"op": "del", "id": item_id}
+            for item_id, item in zip(ids, store.get_many(ids))]
+
+# --- LIVE EVENTS (see events.py) ---
+def subscribe():
+    """A Subscription that receives a message for every change committed
+    from now on, like changes_since() answers; close() it when done."""
+    return _EVENTS.subscribe()
+
+def subscriber_count():
+    return len(_EVENTS)
+
+def catch_up():
+    """Picks up what other processes committed, so their changes reach this
+    process's subscribers. Cheap when nothing changed."""
+    _ensure_derived()
+
+def _publish(revision, ids):
+    """Sends the changes of one commit (ids None: everything may have
+    changed) to the subscribers, if there are any."""
+    if not len(_EVENTS):
+        return
+    if ids is None:
+        _EVENTS.publish({"revision": revision, "reset": True, "changes": []})
+    else:
+        _EVENTS.publish({"revision": revision, "reset": False,
+                         "changes": _describe(_store(), list(dict.fromkeys(ids)))})
+
+def _check_version(item, expected_version):
+    if expected_version is not None and int(expected_version) != item.get("version", 1):
+        raise VersionConflict(item)
+
+def _check_fields(name, publication_date, author, category):
+    """Raises ValueError (codec.ValidationError for a wrong type) unless the
+    fields make a valid item."""
+    if not name or not isinstance(name, str):
+        raise ValueError("Name is required")
     if category not in ALLOWED_CATEGORIES:
         raise ValueError(f"Invalid category. Allowed: {ALLOWED_CATEGORIES}")
-    
-    data = _load()
-    item_id = data["next_id"]
+    codec.check_fields({"publication_date": publication_date, "author": author})
+
+def _create(store, name, publication_date, author, category):
+    _check_fields(name, publication_date, author, category)
     item = {
-        "id": item_id,
+        "id": store.allocate_id(),
         "name": name,
         "publication_date": publication_date,
         "author": author,
         "category": category,
         "status": "Available",     # Default status
         "borrow_date": None,       # New field
-        "borrower": None           # New field
+        "borrower": None,          # New field
+        "version": 1
     }
-    data["items"][str(item_id)] = item
-    data["next_id"] += 1
-    _save(data)
+    store.put(item)
     return item
 
-def update_item(item_id, name, pub, auth, cat):
-    data = _load()
-    key = str(item_id)
-    if key in data["items"]:
-        data["items"][key]["name"] = name
-        data["items"][key]["publication_date"] = pub
-        data["items"][key]["author"] = auth
-        data["items"][key]["category"] = cat
-        _save(data)
-        return data["items"][key]
-    return None
+@_timed
+def create_item(name, publication_date, author, category):
+    with transaction() as store:
+        return _create(store, name, publication_date, author, category)
+
+@_timed
+def update_item(item_id, name, pub, auth, cat, expected_version=None):
+    with transaction() as store:
+        old = store.get(item_id)
+        if old is None:
+            return None
+        _check_version(old, expected_version)
+        _check_fields(name, pub, auth, cat)
+        item = dict(old, name=name, publication_date=pub, author=auth, category=cat,
+                    version=old.get("version", 1) + 1)
+        store.put(item)
+        return item
 
 # --- STATUS UPDATE (Borrow/Return) ---
-def set_status(item_id, new_status, borrow_date=None, borrower=None):
-    data = _load()
-    key = str(item_id)
-    if key in data["items"]:
-        data["items"][key]["status"] = new_status
-        data["items"][key]["borrow_date"] = borrow_date
-        data["items"][key]["borrower"] = borrower
-        _save(data)
-        return data["items"][key]
-    return None
+def _set_status(store, item_id, new_status, borrow_date, borrower, expected_status):
+    old = store.get(item_id)
+    if old is None:
+        return None
+    status = old.get("status", "Available")    # legacy items have no status
+    if expected_status is not None and status != expected_status:
+        raise VersionConflict(old, f"Item is already {status}")
+    item = dict(old, status=new_status, borrow_date=borrow_date, borrower=borrower,
+                version=old.get("version", 1) + 1)
+    store.put(item)
+    return item
+
+@_timed
+def set_status(item_id, new_status, borrow_date=None, borrower=None, expected_status=None):
+    """Changes the loan state. With `expected_status`, refuses (VersionConflict)
+    unless the item is currently in that state, e.g. a second desk trying to
+    borrow an item that was just checked out."""
+    with transaction() as store:
+        return _set_status(store, item_id, new_status, borrow_date, borrower, expected_status)
 
+@_timed
 def delete_item(item_id):
-    data = _load()
-    key = str(item_id)
-    if key in data["items"]:
-        del data["items"][key]
-        _save(data)
-        return True
-    return False
\ No newline at end of file
+    with transaction() as store:
+        return store.delete(item_id)
+
+# --- BULK OPERATIONS ---
+# Each call is one transaction, so the store is written once (one snapshot
+# rewrite, or one batch of log records) however many rows there are. Bad
+# rows are reported and skipped; the good ones are still committed.
+@_timed
+def create_items(rows):
+    """Creates an item per dict in `rows`. Returns (created, errors), where
+    each error is {"row": index, "error": message}."""
+    created, errors = [], []
+    with transaction() as store:
+        for i, row in enumerate(rows):
+            if not isinstance(row, dict):
+                errors.append({"row": i, "error": "Row must be an object"})
+                continue
+            try:
+                created.append(_create(store, row.get("name"), row.get("publication_date"),
+                                       row.get("author"), row.get("category")))
+            except ValueError as e:
+                errors.append({"row": i, "error": str(e)})
+    return created, errors
+
+@_timed
+def set_status_many(item_ids, new_status, borrow_date=None, borrower=None, expected_status=None):
+    """Batch version of set_status. Returns (items, errors), where each error
+    is {"id": item_id, "error": message}."""
+    items, errors = [], []
+    with transaction() as store:
+        for item_id in item_ids:
+            try:
+                item = _set_status(store, item_id, new_status, borrow_date, borrower, expected_status)
+            except VersionConflict as e:
+                errors.append({"id": item_id, "error": str(e)})
+                continue
+            if item is None:
+                errors.append({"id": item_id, "error": "Not found"})
+            else:
+                items.append(item)
+    return items, errors
+
+@_timed
+def delete_items(item_ids):
+    """Batch delete. Returns (deleted_ids, errors)."""
+    deleted, errors = [], []
+    with transaction() as store:
+        for item_id in item_ids:
+            if store.delete(item_id):
+                deleted.append(item_id)
+            else:
+                errors.append({"id": item_id, "error": "Not found"})
+    return deleted, errors
@@ -0,0 +1,77 @@
+"""Live change notifications behind GET /media/events.
+
+database.py publishes one message per committed transaction, shaped like
+a /media/changes answer (backend.py adds the revision it follows, "since"):
+
+    {"revision": 42, "reset": false, "changes": [{"op": "put", "item": {...}}]}
+
+Every open event stream holds a Subscription with its own bounded queue.
+A client that stops reading doesn't make the server buffer without limit:
+once its queue is full, the queue is dropped and the stream catches up
+from the change log instead (or tells the client to reload).
+"""
+import threading
+from collections import deque
+
+
+class Subscription:
+    def __init__(self, hub, max_messages):
+        self._hub = hub
+        self._queue = deque()
+        self.max_messages = max_messages
+        self.overflowed = False
+
+    def get(self, timeout):
+        """Waits up to `timeout` seconds for messages. Returns the list of
+        messages (empty on timeout), or None if some were dropped because
+        the queue was full."""
+        with self._hub._cond:
+            if not self._queue and not self.overflowed:
+                self._hub._cond.wait(timeout)
+            if self.overflowed:
+                self.overflowed = False
+                return None
+            messages = list(self._queue)
+            self._queue.clear()
+            return messages
+
+    def close(self):
+        self._hub._unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class EventHub:
+    def __init__(self, max_messages=256):
+        self.max_messages = max_messages
+        self._cond = threading.Condition()
+        self._subscribers = set()
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def subscribe(self):
+        sub = Subscription(self, self.max_messages)
+        with self._cond:
+            self._subscribers.add(sub)
+        return sub
+
+    def _unsubscribe(self, sub):
+        with self._cond:
+            self._subscribers.discard(sub)
+
+    def publish(self, message):
+        with self._cond:
+            for sub in self._subscribers:
+                if sub.overflowed:
+                    continue
+                if len(sub._queue) >= sub.max_messages:
+                    sub._queue.clear()
+                    sub.overflowed = True
+                else:
+                    sub._queue.append(message)
+            self._cond.notify_all()
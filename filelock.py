@@ -0,0 +1,64 @@
+"""Cross-process lock on a file next to the JSON store.
+
+JsonStore holds it for every write transaction, while re-reading the store
+and while compacting the log, so several server processes can share one
+media_store.json. It is re-entrant within a process; threads are already
+serialized by the store's own lock.
+"""
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    def __init__(self, path):
+        self.path = path
+        self._fh = None
+        self._pid = None
+        self._depth = 0
+
+    def acquire(self):
+        if self._pid != os.getpid():
+            # A forked child must not share the parent's open file: flock
+            # locks belong to it, so both processes would "hold" the lock
+            self._fh, self._pid, self._depth = None, os.getpid(), 0
+        if self._depth == 0:
+            if self._fh is None:
+                self._fh = open(self.path, "a+b")
+            if fcntl is not None:
+                fcntl.flock(self._fh.fileno(), fcntl.LOCK_EX)
+            else:
+                self._fh.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(self._fh.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:   # LK_LOCK gives up after ~10 seconds
+                        pass
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            if fcntl is not None:
+                fcntl.flock(self._fh.fileno(), fcntl.LOCK_UN)
+            else:
+                self._fh.seek(0)
+                msvcrt.locking(self._fh.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def close(self):
+        if self._fh is not None and self._pid == os.getpid():
+            self._fh.close()
+        self._fh = None
+        self._depth = 0
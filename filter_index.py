@@ -0,0 +1,72 @@
+"""Secondary indexes behind GET /media?category=&status=&author=.
+
+For each indexed field, every value maps to the ids of the items that
+have it, kept sorted. database.py feeds it every committed change, like
+the search index and the counters. A filter walks the shortest of the
+lists it names and looks each id up in the others by bisection, so its
+cost follows the size of its most selective field, not of the catalog,
+and results come out in id order (ready for cursor paging).
+"""
+import bisect
+import threading
+
+
+class FilterIndex:
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+        self._lock = threading.Lock()
+        self._ids = {field: {} for field in self.fields}   # field -> value -> sorted ids
+
+    def rebuild(self, items):
+        with self._lock:
+            self._ids = {field: {} for field in self.fields}
+            for item in items:
+                for field in self.fields:
+                    # Items come in id order: appending keeps the lists sorted
+                    self._ids[field].setdefault(item.get(field), []).append(item["id"])
+
+    def apply(self, old, new):
+        """Moves one item from its old values to its new ones (either may be None)."""
+        with self._lock:
+            for field in self.fields:
+                before = old.get(field) if old is not None else None
+                after = new.get(field) if new is not None else None
+                if old is not None and (new is None or before != after):
+                    self._remove(field, before, old["id"])
+                if new is not None and (old is None or before != after):
+                    self._add(field, after, new["id"])
+
+    def _add(self, field, value, item_id):
+        ids = self._ids[field].setdefault(value, [])
+        if not ids or ids[-1] < item_id:
+            ids.append(item_id)
+        else:
+            bisect.insort(ids, item_id)
+
+    def _remove(self, field, value, item_id):
+        ids = self._ids[field].get(value)
+        if not ids:
+            return
+        i = bisect.bisect_left(ids, item_id)
+        if i < len(ids) and ids[i] == item_id:
+            del ids[i]
+            if not ids:
+                del self._ids[field][value]
+
+    def ids(self, criteria, after_id=0):
+        """Ids (ascending, greater than `after_id`) of the items whose fields
+        equal every value in `criteria`, a {field: value} dict."""
+        with self._lock:
+            lists = sorted((self._ids[field].get(value, []) for field, value in criteria.items()), key=len)
+            if not lists:
+                raise ValueError("No filter given")
+            first, others = lists[0], lists[1:]
+            start = bisect.bisect_right(first, after_id)
+            if not others:
+                return first[start:]
+            return [item_id for item_id in first[start:] if all(_contains(ids, item_id) for ids in others)]
+
+
+def _contains(ids, item_id):
+    i = bisect.bisect_left(ids, item_id)
+    return i < len(ids) and ids[i] == item_id
@@ -1,10 +1,29 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
+import json
+import queue
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date # To autofill today's date
 
 API_URL = "http://127.0.0.1:8000"
 
+# --- NETWORK ---
+# One keep-alive session shared by every request, so the TCP connection is
+# reused instead of being set up on each click. Requests run on a small
+# worker pool; the Tk thread never waits on the network.
+SESSION = requests.Session()
+HTTP_WORKERS = 4
+POLL_MS = 30               # how often the Tk thread picks up finished requests
+SEARCH_DEBOUNCE_MS = 300   # search-as-you-type waits for a pause in typing
+ROW_HEIGHT = 30            # must match the Treeview style below
+PAGE_MARGIN = 100          # rows fetched above and below the visible ones
+WHEEL_ROWS = 3
+EVENTS_RETRY_S = 5         # wait before reconnecting a dropped event stream
+SORT_FIELDS = {"ID": "id", "Name": "name", "Category": "category", "Author": "author",
+               "Date": "publication_date", "Status": "status"}
+
 # --- COLORS & FONTS ---
 BG_COLOR = "#F0F2F5"
 HEADER_COLOR = "#2C3E50"
@@ -26,14 +45,38 @@ class ModernApp(tk.Tk):
         
         style = ttk.Style()
         style.theme_use("clam")
-        style.configure("Treeview", background="white", fieldbackground="white", rowheight=30, font=FONT_MAIN, borderwidth=0)
+        style.configure("Treeview", background="white", fieldbackground="white", rowheight=ROW_HEIGHT, font=FONT_MAIN, borderwidth=0)
         style.configure("Treeview.Heading", background="#EAECEF", font=FONT_BOLD, borderwidth=0)
         style.map("Treeview", background=[("selected", ACCENT_COLOR)])
         style.configure("TButton", font=FONT_MAIN, padding=6)
         style.configure("Accent.TButton", background=ACCENT_COLOR, foreground="white", font=FONT_BOLD)
         
+        # Virtual list: the server sorts and pages, we only keep the rows
+        # around the viewport (position -> item) and draw the visible ones.
+        # `revision` is the store revision those rows reflect; see refresh()
+        self.rows = {}
+        self.positions = {}        # item id -> position, for rows we hold
+        self.total = 0
+        self.top = 0               # position of the first visible row
+        self.sort = None           # server sort field, "-field" for descending
+        self.selected = None       # selected item (kept while scrolled away)
+        self.revision = None
+        self.view = ("all", None)
+        self.view_url, self.view_params = f"{API_URL}/media", {}
+
+        # Background requests: results come back through self._done and are
+        # handled on the Tk thread by _poll_results()
+        self.pool = ThreadPoolExecutor(max_workers=HTTP_WORKERS)
+        self._done = queue.Queue()
+        self._latest = {}
+        self._search_job = None
+        self._closing = threading.Event()
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
         self.setup_ui()
+        self._poll_results()
         self.load_data()
+        threading.Thread(target=self._listen_events, name="events", daemon=True).start()
 
     def setup_ui(self):
         # HEADER
@@ -61,9 +104,14 @@ class ModernApp(tk.Tk):
         cb = ttk.Combobox(filter_frame, textvariable=self.cat_var, values=["All", "Book", "Film", "Magazine"], state="readonly", width=12)
         cb.pack(side="left", padx=10)
         cb.bind("<<ComboboxSelected>>", self.filter)
+        self.status_var = tk.StringVar(value="All")
+        cb = ttk.Combobox(filter_frame, textvariable=self.status_var, values=["All", "Available", "Checked Out"], state="readonly", width=12)
+        cb.pack(side="left")
+        cb.bind("<<ComboboxSelected>>", self.filter)
 
         tk.Label(filter_frame, text="Search:", bg=BG_COLOR, font=FONT_BOLD).pack(side="left", padx=(20, 0))
         self.search_var = tk.StringVar()
+        self.search_var.trace_add("write", self.on_search_typed)
         tk.Entry(filter_frame, textvariable=self.search_var, font=FONT_MAIN, width=20, bd=1, relief="solid").pack(side="left", padx=10)
         tk.Button(filter_frame, text="Go", bg=ACCENT_COLOR, fg="white", bd=0, padx=10, command=self.search).pack(side="left")
         tk.Button(filter_frame, text="↻ Reset", bg="#95A5A6", fg="white", bd=0, padx=10, command=self.load_data).pack(side="left", padx=5)
@@ -74,15 +122,25 @@ class ModernApp(tk.Tk):
         
         cols = ("ID", "Name", "Category", "Author", "Date", "Status")
         self.tree = ttk.Treeview(tree_frame, columns=cols, show="headings", selectmode="browse")
-        self.tree.heading("ID", text="ID", anchor="w"); self.tree.column("ID", width=40, anchor="w")
-        self.tree.heading("Name", text="Name", anchor="w"); self.tree.column("Name", width=200, anchor="w")
-        self.tree.heading("Category", text="Type", anchor="w"); self.tree.column("Category", width=80, anchor="w")
-        self.tree.heading("Author", text="Author", anchor="w"); self.tree.column("Author", width=150, anchor="w")
-        self.tree.heading("Date", text="Date", anchor="w"); self.tree.column("Date", width=100, anchor="w")
-        self.tree.heading("Status", text="Status", anchor="w"); self.tree.column("Status", width=100, anchor="w")
-        
+        self.headings = {"ID": "ID", "Name": "Name", "Category": "Type", "Author": "Author", "Date": "Date", "Status": "Status"}
+        for col, width in (("ID", 40), ("Name", 200), ("Category", 80), ("Author", 150), ("Date", 100), ("Status", 100)):
+            self.tree.heading(col, text=self.headings[col], anchor="w", command=lambda c=col: self.sort_by(SORT_FIELDS[c]))
+            self.tree.column(col, width=width, anchor="w")
+
+        # The tree only ever holds the visible rows, so it gets an external
+        # scrollbar that reflects the position in the whole result
+        self.vbar = ttk.Scrollbar(tree_frame, orient="vertical", command=self.on_scrollbar)
+        self.vbar.pack(side="right", fill="y")
         self.tree.pack(side="left", fill="both", expand=True, padx=1, pady=1)
         self.tree.bind("<<TreeviewSelect>>", self.on_select)
+        self.tree.bind("<Configure>", lambda e: self.render())
+        self.tree.bind("<MouseWheel>", self.on_wheel)
+        self.tree.bind("<Button-4>", self.on_wheel)
+        self.tree.bind("<Button-5>", self.on_wheel)
+        self.tree.bind("<Up>", lambda e: self.move_selection(-1))
+        self.tree.bind("<Down>", lambda e: self.move_selection(1))
+        self.tree.bind("<Prior>", lambda e: self.scroll_to(self.top - self.visible_count()))
+        self.tree.bind("<Next>", lambda e: self.scroll_to(self.top + self.visible_count()))
 
         # RIGHT PANEL: Details
         self.right_panel = tk.Frame(main_container, bg="white", width=320, bd=1, relief="solid")
@@ -113,33 +171,240 @@ class ModernApp(tk.Tk):
         self.btn_del = tk.Button(self.right_panel, text="Delete Item", bg="#E74C3C", fg="white", font=FONT_BOLD, bd=0, padx=20, pady=8, cursor="hand2", command=self.delete, state="disabled")
         self.btn_del.pack(side="bottom", pady=20, padx=20, fill="x")
 
+    # --- BACKGROUND REQUESTS ---
+    def run_async(self, fn, on_done, on_error=None, key=None):
+        """Runs fn() on the worker pool and calls on_done(result) on the Tk
+        thread. Calls sharing a `key` supersede each other: an older one
+        that hasn't started is skipped, and its late result is dropped."""
+        token = object()
+        if key: self._latest[key] = token
+        def job():
+            if key and self._latest.get(key) is not token: return
+            try: self._done.put((key, token, on_done, on_error, fn(), None))
+            except Exception as e: self._done.put((key, token, on_done, on_error, None, e))
+        self.pool.submit(job)
+
+    def _poll_results(self):
+        while True:
+            try: key, token, on_done, on_error, result, error = self._done.get_nowait()
+            except queue.Empty: break
+            if key and self._latest.get(key) is not token: continue  # stale
+            if error is not None: (on_error or self.connection_error)(error)
+            else: on_done(result)
+        self.after(POLL_MS, self._poll_results)
+
+    def connection_error(self, error):
+        messagebox.showerror("Connection Error", "Is backend.py running?")
+
+    def on_close(self):
+        self._closing.set()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.destroy()
+
+    # --- LIVE UPDATES ---
+    # A background thread keeps GET /media/events open. Changes made at other
+    # desks arrive as events and are patched into the rows we hold, the same
+    # way as our own (apply_delta), so nobody needs to press Reset or poll.
+    def _listen_events(self):
+        since = None
+        while not self._closing.is_set():
+            try:
+                params = {"since": since} if since is not None else {}
+                with requests.get(f"{API_URL}/media/events", params=params, stream=True, timeout=(5, 60)) as r:
+                    data = []
+                    for line in r.iter_lines(decode_unicode=True):
+                        if self._closing.is_set(): return
+                        if line.startswith("data:"): data.append(line[5:].strip())
+                        elif not line and data:
+                            event = json.loads("".join(data))
+                            data = []
+                            since = event["revision"]
+                            self._done.put((None, None, self.on_event, None, event, None))
+            except (requests.RequestException, ValueError):
+                pass
+            self._closing.wait(EVENTS_RETRY_S)
+
+    def on_event(self, event):
+        if self.revision is None: return  # a page is loading and will be current
+        if not event["reset"] and event["revision"] <= self.revision: return
+        # Patch directly when the event follows our revision, else ask for the gap
+        if event["reset"] or event["since"] != self.revision: return self.refresh()
+        self.apply_delta(event)
+
     # --- LOGIC ---
     def load_data(self):
-        try:
-            self.populate(requests.get(f"{API_URL}/media").json())
-        except: messagebox.showerror("Connection Error", "Is backend.py running?")
-
-    def populate(self, items):
+        self.set_view(("all", None), f"{API_URL}/media")
+
+    def set_view(self, view, url, params=None):
+        """Switches the list to another result set, starting at the top."""
+        self.view, self.view_url, self.view_params = view, url, params or {}
+        self.rows, self.positions = {}, {}
+        self.top = self.total = 0
+        self.revision = None
+        self.render()
+        self.fetch_window()
+
+    def reload_view(self):
+        """Re-fetches the rows around the viewport, keeping the scroll position."""
+        self.rows, self.positions = {}, {}
+        self.fetch_window()
+
+    def fetch_window(self):
+        """Loads the page of rows around the viewport; a newer page request
+        cancels an older one, so fast scrolling only fetches where it stops."""
+        offset = max(0, self.top - PAGE_MARGIN)
+        limit = self.visible_count() + 2 * PAGE_MARGIN
+        url, params = self.view_url, dict(self.view_params, offset=offset, limit=limit)
+        if self.sort: params["sort"] = self.sort
+        def fetch():
+            r = SESSION.get(url, params=params)
+            etag = r.headers.get("ETag", "").strip('"')
+            return offset, limit, r.json(), int(r.headers.get("X-Total-Count", 0)), int(etag) if etag.isdigit() else None
+        self.run_async(fetch, self.fill_window, key="page")
+
+    def fill_window(self, result):
+        offset, limit, items, total, revision = result
+        if len(items) < limit: total = min(total, offset + len(items))  # the page is the truth at the end
+        # Forget rows far from the viewport so memory follows the window, not the catalog
+        count = self.visible_count()
+        lo, hi = self.top - 2 * PAGE_MARGIN, self.top + count + 2 * PAGE_MARGIN
+        self.rows = {p: m for p, m in self.rows.items() if lo <= p < hi}
+        for pos, item in enumerate(items, offset):
+            self.rows[pos] = item
+        self.positions = {m["id"]: p for p, m in self.rows.items()}
+        self.total = total
+        if self.revision is None: self.revision = revision
+        self.render()
+        # This page is newer than the rows we kept: catch up with the changes in between
+        if revision is not None and revision > self.revision: self.refresh()
+
+    def row_values(self, i):
+        return (i["id"], i["name"], i["category"], i["author"], i.get("publication_date", ""), i.get("status", "Available"))
+
+    # --- VIRTUAL LIST ---
+    def visible_count(self):
+        # One row's worth of height goes to the headings
+        return max(1, self.tree.winfo_height() // ROW_HEIGHT - 1)
+
+    def render(self):
+        """Redraws the visible rows from self.rows; rows we don't hold yet
+        show as placeholders and trigger a page fetch."""
+        count = self.visible_count()
+        self.top = max(0, min(self.top, self.total - count))
+        end = min(self.total, self.top + count)
+        self.vbar.set(self.top / self.total if self.total else 0, end / self.total if self.total else 1)
         self.tree.delete(*self.tree.get_children())
-        for i in items:
-            status = i.get("status", "Available")
-            self.tree.insert("", "end", values=(i["id"], i["name"], i["category"], i["author"], i.get("publication_date", ""), status))
+        missing = False
+        for pos in range(self.top, end):
+            item = self.rows.get(pos)
+            if item is None:
+                missing = True
+                self.tree.insert("", "end", iid=f"pos-{pos}", values=("", "Loading…", "", "", "", ""))
+            else:
+                self.tree.insert("", "end", iid=str(item["id"]), values=self.row_values(item))
+        if self.selected and self.tree.exists(str(self.selected["id"])):
+            self.tree.selection_set(str(self.selected["id"]))
+        if missing: self.fetch_window()
+
+    def scroll_to(self, top):
+        self.top = top
+        self.render()
+        return "break"
+
+    def on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            return self.scroll_to(int(float(amount) * self.total))
+        step = int(amount) * (self.visible_count() if unit == "pages" else 1)
+        self.scroll_to(self.top + step)
+
+    def on_wheel(self, event):
+        up = event.num == 4 or getattr(event, "delta", 0) > 0
+        return self.scroll_to(self.top + (-WHEEL_ROWS if up else WHEEL_ROWS))
+
+    def move_selection(self, step):
+        """Arrow keys: the tree only holds the visible rows, so moving past
+        the edge scrolls the window instead."""
+        pos = self.positions.get(self.selected["id"]) if self.selected else None
+        pos = self.top if pos is None else max(0, min(self.total - 1, pos + step))
+        count = self.visible_count()
+        if pos < self.top: self.top = pos
+        elif pos >= self.top + count: self.top = pos - count + 1
+        if pos in self.rows: self.selected = self.rows[pos]
+        self.render()
+        self.on_select(None)
+        return "break"
+
+    def sort_by(self, field):
+        """Column header click: sort by that column, again to reverse it."""
+        self.sort = "-" + field if self.sort == field else field
+        for col, f in SORT_FIELDS.items():
+            arrow = "" if self.sort.lstrip("-") != f else " ▼" if self.sort.startswith("-") else " ▲"
+            self.tree.heading(col, text=self.headings[col] + arrow)
+        self.set_view(self.view, self.view_url, self.view_params)
+
+    # --- DELTA SYNC ---
+    # After an action we only ask for what changed since our revision. Rows
+    # we hold are patched in place; anything that can shift positions
+    # (creates, deletes, changes to the sort or filter field) re-fetches the
+    # window instead.
+    def refresh(self):
+        if self.revision is None: return self.reload_view()
+        since = self.revision
+        self.run_async(lambda: SESSION.get(f"{API_URL}/media/changes", params={"since": since}).json(),
+                       self.apply_delta, key="refresh")
+
+    def apply_delta(self, delta):
+        if delta["reset"]: return self.reload_view()
+        self.revision = delta["revision"]
+        refetch = False
+        for change in delta["changes"]:
+            item_id = change["id"] if change["op"] == "del" else change["item"]["id"]
+            if self.selected and self.selected["id"] == item_id:
+                self.selected = change.get("item")
+                if self.selected is None: self.reset_details()
+            pos = self.positions.get(item_id)
+            if change["op"] == "del" or pos is None or self.moves(self.rows[pos], change["item"]):
+                refetch = True
+            else:
+                self.rows[pos] = change["item"]
+        if refetch: self.reload_view()
+        else: self.render()
+        self.on_select(None)
+
+    def moves(self, old, new):
+        """Whether an update can move the item within (or out of) the view."""
+        kind, arg = self.view
+        if kind == "search": return old["name"] != new["name"] or old["author"] != new["author"]
+        if kind == "filter" and any(new.get(f) != v for f, v in arg.items()): return True
+        field = (self.sort or "id").lstrip("-")
+        return old.get(field) != new.get(field)
+
+    def selected_id(self):
+        return self.selected["id"] if self.selected else None
 
     def filter(self, e):
-        c = self.cat_var.get()
-        url = f"{API_URL}/media" if c == "All" else f"{API_URL}/media/category/{c}"
-        self.populate(requests.get(url).json())
+        filters = {f: v.get() for f, v in (("category", self.cat_var), ("status", self.status_var)) if v.get() != "All"}
+        if not filters: return self.load_data()
+        self.set_view(("filter", filters), f"{API_URL}/media", filters)
+
+    def on_search_typed(self, *args):
+        if self._search_job: self.after_cancel(self._search_job)
+        self._search_job = self.after(SEARCH_DEBOUNCE_MS, self.search)
 
     def search(self):
+        if self._search_job: self.after_cancel(self._search_job)
+        self._search_job = None
         name = self.search_var.get()
         if not name: return self.load_data()
-        self.populate(requests.get(f"{API_URL}/media/search", params={"name": name}).json())
+        self.set_view(("search", name), f"{API_URL}/media/search", {"name": name})
 
     def on_select(self, e):
         sel = self.tree.selection()
-        if not sel: return
-        item_id = self.tree.item(sel[0])['values'][0]
-        data = requests.get(f"{API_URL}/media/{item_id}").json()
+        if sel and sel[0].isdigit():
+            pos = self.positions.get(int(sel[0]))
+            if pos is not None: self.selected = self.rows[pos]
+        data = self.selected
+        if data is None: return
         
         self.lbl_name.config(text=data['name'])
         self.lbl_meta.config(text=f"Author: {data['author']}\nCategory: {data['category']}\nPublished: {data['publication_date']}")
@@ -165,8 +430,8 @@ class ModernApp(tk.Tk):
 
     def open_borrow_window(self):
         """Opens popup to enter Borrower Name and Date"""
-        if not self.tree.selection(): return
-        item_id = self.tree.item(self.tree.selection()[0])['values'][0]
+        item_id = self.selected_id()
+        if item_id is None: return
         
         top = tk.Toplevel(self)
         top.title("Borrow Item")
@@ -187,37 +452,37 @@ class ModernApp(tk.Tk):
                 messagebox.showwarning("Error", "Name is required")
                 return
             
+            def done(r):
+                if r.status_code == 409:
+                    messagebox.showwarning("Not Available", r.json().get("error", "Item is already checked out"))
+                self.refresh()
+
             # Send name AND date to backend
-            requests.post(f"{API_URL}/media/{item_id}/borrow", json={
-                "borrower": name_entry.get(),
-                "borrow_date": date_entry.get()
-            })
-            self.load_data()
-            self.on_select(None)
+            payload = {"borrower": name_entry.get(), "borrow_date": date_entry.get()}
+            self.run_async(lambda: SESSION.post(f"{API_URL}/media/{item_id}/borrow", json=payload), done)
             top.destroy()
             
         tk.Button(top, text="Confirm Borrow", bg=BORROW_COLOR, fg="white", font=FONT_BOLD, bd=0, command=confirm).pack(fill="x", padx=20, pady=20)
 
     def return_item(self):
-        requests.post(f"{API_URL}/media/{self.tree.item(self.tree.selection()[0])['values'][0]}/return")
-        self.load_data(); self.on_select(None)
+        item_id = self.selected_id()
+        self.run_async(lambda: SESSION.post(f"{API_URL}/media/{item_id}/return"), lambda r: self.refresh())
 
     def show_stats(self):
-        try:
-            stats = requests.get(f"{API_URL}/stats").json()
+        def show(stats):
             msg = f"📚 Total Items: {stats['total']}\n\n" \
                   f"📖 Books: {stats['Book']}\n" \
                   f"🎬 Films: {stats['Film']}\n" \
                   f"📰 Magazines: {stats['Magazine']}\n\n" \
                   f"🔴 Currently Borrowed: {stats['Borrowed']}"
             messagebox.showinfo("Library Statistics", msg)
-        except:
-            messagebox.showerror("Error", "Could not fetch stats.")
+        self.run_async(lambda: SESSION.get(f"{API_URL}/stats").json(), show,
+                       lambda e: messagebox.showerror("Error", "Could not fetch stats."))
 
     def delete(self):
         if messagebox.askyesno("Confirm", "Delete this item?"):
-            requests.delete(f"{API_URL}/media/{self.tree.item(self.tree.selection()[0])['values'][0]}")
-            self.load_data()
+            item_id = self.selected_id()
+            self.run_async(lambda: SESSION.delete(f"{API_URL}/media/{item_id}"), lambda r: self.refresh())
             self.reset_details()
 
     def reset_details(self):
@@ -234,10 +499,11 @@ class ModernApp(tk.Tk):
         self.form_window("Add Media", {}, self.save_new)
 
     def open_edit_window(self):
-        if not self.tree.selection(): return
-        item_id = self.tree.item(self.tree.selection()[0])['values'][0]
-        data = requests.get(f"{API_URL}/media/{item_id}").json()
-        self.form_window(f"Edit Media #{item_id}", data, lambda p: self.save_edit(item_id, p))
+        item_id = self.selected_id()
+        if item_id is None: return
+        data = self.selected
+        # Send back the version we edited so the server can reject stale saves
+        self.form_window(f"Edit Media #{item_id}", data, lambda p: self.save_edit(item_id, dict(p, version=data.get("version"))))
 
     def form_window(self, title, data, save_cb):
         top = tk.Toplevel(self)
@@ -271,13 +537,14 @@ class ModernApp(tk.Tk):
         tk.Button(top, text="Save", bg=ACCENT_COLOR, fg="white", font=FONT_BOLD, bd=0, command=submit, pady=8).pack(fill="x", padx=20, pady=20)
 
     def save_new(self, payload):
-        requests.post(f"{API_URL}/media", json=payload)
-        self.load_data()
+        self.run_async(lambda: SESSION.post(f"{API_URL}/media", json=payload), lambda r: self.refresh())
 
     def save_edit(self, item_id, payload):
-        requests.put(f"{API_URL}/media/{item_id}", json=payload)
-        self.load_data()
-        self.on_select(None) # Refresh details view
+        def done(r):
+            if r.status_code == 409:
+                messagebox.showwarning("Edit Conflict", "Someone else changed this item while you were editing. Your changes were not saved.")
+            self.refresh() # Also refreshes the details view
+        self.run_async(lambda: SESSION.put(f"{API_URL}/media/{item_id}", json=payload), done)
 
 if __name__ == "__main__":
     app = ModernApp()
@@ -0,0 +1,477 @@
+"""JSON file storage backend.
+
+The whole catalog is kept resident in memory and persisted to
+media_store.json, either by rewriting the file on every commit ("json"
+mode) or by appending to a write-ahead log that is compacted in the
+background ("wal" mode, see wal.py). Several processes can share the same
+files: writes and reloads hold a cross-process lock (filelock.py).
+
+In memory, items are compact records (records.Item) keyed by integer id;
+set BOOKHAVEN_ITEMS=dict to keep plain dicts instead (e.g. to compare
+memory use in benchmark.py).
+"""
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import codec
+import metrics
+import records
+import wal
+from filelock import FileLock
+
+WAL_SYNC_EVERY = 64               # fsync after this many records...
+WAL_SYNC_INTERVAL = 1.0           # ...or after this many seconds
+WAL_COMPACT_BYTES = 4 * 1024 * 1024
+MAX_ORDERINGS = 8                 # sorted id lists kept for page()
+COMPACT_ITEMS = os.environ.get("BOOKHAVEN_ITEMS", "compact") != "dict"
+
+
+class CorruptStoreError(ValueError):
+    """The snapshot on disk cannot be parsed; the store refuses to load it."""
+
+
+def sort_key(field):
+    """Sort key for items: missing values first, then numbers, then strings
+    (like SQLite's ORDER BY), so mixed-type fields still sort."""
+    def key(item):
+        value = item.get(field)
+        return value is not None, isinstance(value, str), value
+    return key
+
+
+def _moves(key, old, new):
+    """True if changing `old` into `new` can move items of the ordering
+    `key` = (category, field, descending)."""
+    category, field, _ = key
+    was_in = old is not None and (category is None or old.get("category") == category)
+    is_in = new is not None and (category is None or new.get("category") == category)
+    if was_in != is_in:
+        return True
+    return was_in and old.get(field) != new.get(field)
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+class JsonStore:
+    """Resident catalog backed by a JSON snapshot (plus log in wal mode).
+
+    Reads are served from memory; the file is only parsed again when its
+    mtime/size no longer match what we last read or wrote (e.g. another
+    server process wrote to it). In wal mode, when only the log grew, just
+    the new records are replayed.
+    """
+
+    def __init__(self, path, mode="json", compact_items=COMPACT_ITEMS):
+        self.path = path
+        self.mode = mode
+        self.compact_items = compact_items
+        self._pack = records.pack if compact_items else dict
+        self.wal_path = path + ".log"
+        self.lock = threading.RLock()
+        self._flock = FileLock(path + ".lock")
+        self._pid = os.getpid()
+        self._data = None
+        self._stamp = None
+        self._log = None
+        self._compactor = None
+        self._generation = 0
+        self._log_offset = 0              # bytes of the log already applied
+        self._foreign = []                # (old, new) changes replayed from other processes
+        self._pinned = 0                  # open snapshot()s: don't pick up outside changes
+        self._orderings = OrderedDict()   # (category, field, descending) -> ids
+        self._ids = None                  # every item id, ascending (id-order pages)
+        # Open transaction state: log records to write and undo entries
+        self._depth = 0
+        self._records = []
+        self._undo = []
+
+    # --- FILES ---
+    def _init_file(self):
+        """Creates the file if it doesn't exist OR if it is empty."""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            self._write_snapshot({"next_id": 1, "items": {}, "loans": []})
+
+    def _write_snapshot(self, data):
+        """Writes the full store to a temp file and renames it into place, so a
+        crash mid-write leaves the previous snapshot intact."""
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            with metrics.timed("bookhaven_store_seconds", op="serialize"):
+                size = codec.write_snapshot(f, data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        metrics.inc("bookhaven_store_bytes_written_total", size, file="snapshot")
+
+    def _current_stamp(self):
+        if self.mode == "wal":
+            return (_stat(self.path), _stat(self.wal_path))
+        return (_stat(self.path),)
+
+    def load(self):
+        """Returns the resident store dict, re-reading the file only if it changed."""
+        with self.lock:
+            if self._pid != os.getpid():
+                self._after_fork()
+            if self._data is None or (not self._pinned and self._stamp != self._current_stamp()):
+                with self._flock:
+                    self._init_file()
+                    stamp = self._current_stamp()
+                    if self._data is None or self._stamp != stamp:
+                        self._reload(stamp)
+            return self._data
+
+    def _reload(self, stamp):
+        log_stat = stamp[-1] if self.mode == "wal" else None
+        if (self._data is not None and self.mode == "wal" and stamp[0] == self._stamp[0]
+                and log_stat is not None and log_stat[1] >= self._log_offset):
+            # Same snapshot, longer log: another process appended records
+            with metrics.timed("bookhaven_store_seconds", op="replay"):
+                offset = wal.replay(self.wal_path, self._replayer(self._data, self._replayed), self._log_offset)
+            metrics.inc("bookhaven_store_bytes_read_total", offset - self._log_offset, file="log")
+            self._log_offset = offset
+        else:
+            with metrics.timed("bookhaven_store_seconds", op="load"):
+                try:
+                    with open(self.path, "rb") as f:
+                        data, size = codec.read_snapshot(f, records.Item.from_dict if self.compact_items else None)
+                except json.JSONDecodeError as e:
+                    # Never fall back to an empty catalog: the next commit
+                    # would overwrite the only copy of the data.
+                    raise CorruptStoreError(f"{self.path} is corrupt or truncated ({e}); "
+                                            "restore it from a backup or move it aside") from e
+                data["items"] = {int(key): self._normalized(item) for key, item in data["items"].items()}
+                data.setdefault("loans", [])
+                if self.mode == "wal":
+                    self._log_offset = wal.replay(self.wal_path, self._replayer(data))
+                    self._start_compactor()
+            metrics.inc("bookhaven_store_bytes_read_total", size, file="snapshot")
+            if self._log_offset:
+                metrics.inc("bookhaven_store_bytes_read_total", self._log_offset, file="log")
+            self._data = data
+            self._generation += 1
+            self._foreign = []
+            self._orderings.clear()
+            self._ids = None
+        self._stamp = stamp
+
+    def _normalized(self, item):
+        """Items saved before they had a status are Available (as the SQLite
+        import stores them), so indexes and filters never see None."""
+        if "status" in item:
+            return item
+        return self._pack(dict(item, status="Available"))
+
+    def _replayed(self, change):
+        self._foreign.append(change)
+        self._reorder(*change)
+
+    def _replayer(self, data, on_change=None):
+        """Applies one log record to `data`, reporting the (old, new) items."""
+        items = data["items"]
+
+        def apply(record):
+            if record["op"] == "put":
+                new = self._pack(record["item"])
+                old = items.get(new["id"])
+                items[new["id"]] = new
+                if on_change is not None:
+                    on_change((old, new))
+            elif record["op"] == "del":
+                old = items.pop(int(record["id"]), None)
+                if old is not None and on_change is not None:
+                    on_change((old, None))
+            elif record["op"] == "loan":
+                if record["event"]["seq"] == len(data["loans"]) + 1:
+                    data["loans"].append(record["event"])
+            if "next_id" in record:
+                data["next_id"] = max(data["next_id"], record["next_id"])
+            if "revision" in record:
+                data["revision"] = max(data.get("revision", 0), record["revision"])
+        return apply
+
+    def take_foreign_changes(self):
+        """(old, new) item pairs that other processes committed since the
+        last call, so derived indexes can be patched instead of rebuilt.
+        Empty after a full reload (generation() changes instead)."""
+        changes, self._foreign = self._foreign, []
+        return changes
+
+    def _after_fork(self):
+        # The log handle, compactor thread and file lock belong to the parent
+        self._pid = os.getpid()
+        self._log = None
+        self._compactor = None
+
+    def generation(self):
+        """Changes whenever the catalog was (re)read from disk."""
+        self.load()
+        return self._generation
+
+    def disk_size(self):
+        return sum(st[1] for st in self._current_stamp() if st is not None)
+
+    def invalidate(self):
+        """Forces the next read to parse the store file again."""
+        with self.lock:
+            self._data = None
+            self._stamp = None
+
+    # --- READS ---
+    def get(self, item_id):
+        return self.load()["items"].get(int(item_id))
+
+    def get_many(self, ids):
+        """The items for `ids`, in the same order (None where an id is gone).
+        Loads once, then reads the resident dict lazily, so a caller that
+        stops after one page only looks up that page."""
+        return map(self.load()["items"].get, ids)
+
+    def all(self):
+        return list(self.load()["items"].values())
+
+    def iter_items(self, category=None, after_id=0):
+        """Yields items in id order, starting after `after_id`.
+
+        Walks the id range instead of the dict, so it never copies the
+        catalog and is safe while other threads add or delete items. The
+        store is loaded (and stat'ed) once per call, not once per item.
+        """
+        data = self.load()
+        items = data["items"]
+        item_id = int(after_id) + 1
+        while item_id < data["next_id"]:
+            item = items.get(item_id)
+            if item is not None and (category is None or item["category"] == category):
+                yield item
+            item_id += 1
+
+    def page(self, category, field, descending, offset, limit):
+        """Items `offset`..`offset + limit` in `field` order (ties by id).
+        Sorted id lists are kept until a change could reorder them."""
+        with self.lock:
+            data = self.load()
+            if self._ids is None:
+                self._ids = sorted(data["items"])
+            if field == "id" and category is None:
+                ids = self._ids
+                end = len(ids) - offset
+                page = ids[max(0, end - limit):max(0, end)][::-1] if descending else ids[offset:offset + limit]
+                return [data["items"][i] for i in page]
+            key = (category, field, descending)
+            ids = self._orderings.get(key)
+            if ids is None:
+                items = [m for m in map(data["items"].__getitem__, self._ids)
+                         if category is None or m["category"] == category]
+                items.sort(key=sort_key(field), reverse=descending)
+                ids = self._orderings[key] = [m["id"] for m in items]
+                if len(self._orderings) > MAX_ORDERINGS:
+                    self._orderings.popitem(last=False)
+            else:
+                self._orderings.move_to_end(key)
+            return [data["items"][i] for i in ids[offset:offset + limit]]
+
+    def _reorder(self, old, new):
+        """Keeps the id list and the cached orderings in step with one change
+        (`old` or `new` is None for an added or deleted item). Orderings the
+        change cannot have reordered, e.g. by name after a borrow, are kept."""
+        if self._ids is not None and (old is None) != (new is None):
+            if old is None:
+                bisect.insort(self._ids, new["id"])
+            else:
+                del self._ids[bisect.bisect_left(self._ids, old["id"])]
+        for key in [key for key in self._orderings if _moves(key, old, new)]:
+            del self._orderings[key]
+
+    def by_name(self, name):
+        return [m for m in self.all() if m["name"] == name]
+
+    def iter_loans(self, after_seq=0):
+        """Yields loan ledger events (see loans.py) after `after_seq`."""
+        loans = self.load()["loans"]
+        for i in range(after_seq, len(loans)):
+            yield loans[i]
+
+    @contextmanager
+    def snapshot(self):
+        """A consistent read of the whole store, e.g. to rebuild derived
+        indexes. Holds only the in-process lock, so other processes can keep
+        committing meanwhile; their changes are picked up afterwards."""
+        with self.lock:
+            self.load()
+            self._pinned += 1
+            try:
+                yield self
+            finally:
+                self._pinned -= 1
+
+    # --- WRITES ---
+    @contextmanager
+    def transaction(self):
+        """Holds the store lock for a whole read-modify-write. Changes are
+        persisted once when the outermost transaction exits, and rolled back
+        in memory if it raises."""
+        start = time.perf_counter()
+        with self.lock, self._flock:
+            if self._pinned and self._depth == 0:
+                raise RuntimeError("Cannot write inside snapshot()")
+            if self._depth == 0:
+                metrics.observe("bookhaven_store_seconds", time.perf_counter() - start, op="lock_wait")
+            self.load()
+            self._depth += 1
+            try:
+                yield self
+            except BaseException:
+                if self._depth == 1:
+                    self._rollback()
+                raise
+            finally:
+                self._depth -= 1
+            if self._depth == 0:
+                self._commit()
+
+    def revision(self):
+        return self.load().get("revision", 0)
+
+    def bump_revision(self):
+        """Called once per committed transaction that changed something."""
+        data = self._data
+        self._undo.append(("revision", data.get("revision", 0)))
+        data["revision"] = data.get("revision", 0) + 1
+        self._records.append({"op": "rev", "revision": data["revision"]})
+        return data["revision"]
+
+    def allocate_id(self):
+        data = self._data
+        item_id = data["next_id"]
+        self._undo.append(("next_id", data["next_id"]))
+        data["next_id"] += 1
+        return item_id
+
+    def put(self, item):
+        key = item["id"]
+        old = self._data["items"].get(key)
+        self._undo.append((key, old))
+        self._data["items"][key] = self._pack(item)
+        self._reorder(old, self._data["items"][key])
+        plain = item if type(item) is dict else dict(item)
+        self._records.append({"op": "put", "item": plain, "next_id": self._data["next_id"]})
+
+    def append_loan(self, event):
+        """Adds an event to the loan ledger; returns it with its `seq`."""
+        loans = self._data["loans"]
+        event = {"seq": len(loans) + 1, **event}
+        self._undo.append(("loans", None))
+        loans.append(event)
+        self._records.append({"op": "loan", "event": event})
+        return event
+
+    def delete(self, item_id):
+        key = int(item_id)
+        old = self._data["items"].pop(key, None)
+        if old is None:
+            return False
+        self._undo.append((key, old))
+        self._records.append({"op": "del", "id": int(item_id)})
+        self._reorder(old, None)
+        return True
+
+    def _rollback(self):
+        items = self._data["items"]
+        for key, old in reversed(self._undo):
+            if key in ("next_id", "revision"):
+                self._data[key] = old
+            elif key == "loans":
+                self._data["loans"].pop()
+            elif old is None:
+                self._reorder(items.pop(key, None), None)
+            else:
+                self._reorder(items.get(key), old)
+                items[key] = old
+        self._undo = []
+        self._records = []
+
+    def _commit(self):
+        """Writes the transaction out. If that fails (e.g. disk full), the
+        changes are undone in memory too, so memory keeps matching disk."""
+        if not self._records:
+            self._undo = []
+            return
+        try:
+            with metrics.timed("bookhaven_store_seconds", op="save"):
+                if self.mode == "wal":
+                    if self._log is None:
+                        self._log = wal.WriteAheadLog(self.wal_path, WAL_SYNC_EVERY, WAL_SYNC_INTERVAL)
+                    if self._log.size() != self._log_offset:
+                        self._log.drop_torn_tail()   # another process (or a failed append) left half a record
+                    self._log.append_many(self._records)
+                    size = self._log.size()
+                    metrics.inc("bookhaven_store_bytes_written_total", size - self._log_offset, file="log")
+                    self._log_offset = size
+                else:
+                    self._write_snapshot(self._data)
+        except BaseException:
+            self._rollback()
+            if self.mode == "wal" and self._log is not None:
+                try:
+                    self._log.rewind(self._log_offset)
+                except OSError:
+                    self._data = None   # can't tell what is on disk: re-read it
+            raise
+        self._records, self._undo = [], []
+        self._stamp = self._current_stamp()
+
+    # --- WAL COMPACTION ---
+    def compact(self):
+        """Folds the write-ahead log into a fresh snapshot and empties the log.
+
+        Runs under the store lock; records are idempotent, so a crash between
+        the snapshot rename and the log truncation only replays them again.
+        """
+        with self.lock, self._flock:
+            data = self.load()
+            log = self._log or wal.WriteAheadLog(self.wal_path)
+            if log.size() == 0:
+                return False
+            with metrics.timed("bookhaven_store_seconds", op="compact"):
+                self._write_snapshot(data)
+            log.truncate()
+            self._log_offset = 0
+            self._stamp = self._current_stamp()
+            return True
+
+    def _compactor_loop(self):
+        while True:
+            time.sleep(WAL_SYNC_INTERVAL)
+            with self.lock:
+                log = self._log
+                if log is None:
+                    continue
+                if log.sync_due():
+                    log.sync()
+                if log.size() >= WAL_COMPACT_BYTES:
+                    self.compact()
+
+    def _start_compactor(self):
+        if self._compactor is None:
+            self._compactor = threading.Thread(target=self._compactor_loop, name="wal-compactor", daemon=True)
+            self._compactor.start()
+            atexit.register(self.close)
+
+    def close(self):
+        with self.lock:
+            if self._log is not None:
+                self._log.close()
+            self._flock.close()
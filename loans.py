@@ -0,0 +1,141 @@
+"""Loan ledger behind /patrons/<name>/loans, /loans/overdue and
+/media/<id>/history.
+
+Items only remember their current loan, so every check-out and return is
+also appended to the store as an event (see events_for), and never edited:
+
+    {"seq": 7, "type": "open",  "item_id": 3, "borrower": "Ann", "date": "2024-05-02", "due": "2024-05-16"}
+    {"seq": 9, "type": "close", "item_id": 3, "borrower": "Ann", "date": "2024-05-10", "borrowed": "2024-05-02"}
+
+database.py replays the events into a LoanLedger, which indexes the open
+loans by borrower and by due date (a sorted list), so each query costs a
+lookup or a bisect plus the size of its answer.
+"""
+import bisect
+import threading
+from datetime import date, timedelta
+
+
+def _iso(value):
+    """`value` if it is a YYYY-MM-DD date, else None."""
+    try:
+        return date.fromisoformat(value).isoformat() if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _on_loan(item):
+    return item is not None and item.get("status") == "Checked Out"
+
+
+def open_event(item, loan_days):
+    borrowed = item.get("borrow_date")
+    start = _iso(borrowed)
+    due = (date.fromisoformat(start) + timedelta(days=loan_days)).isoformat() if start else None
+    return {"type": "open", "item_id": item["id"], "borrower": item.get("borrower"),
+            "date": borrowed, "due": due}
+
+
+def events_for(old, new, loan_days, today=None):
+    """Ledger events for an item going from `old` to `new` (either may be
+    None): a close when a loan ends, an open when one starts, both when
+    an item is handed straight to someone else."""
+    was_out, is_out = _on_loan(old), _on_loan(new)
+    same_loan = (was_out and is_out and old.get("borrower") == new.get("borrower")
+                 and old.get("borrow_date") == new.get("borrow_date"))
+    if same_loan:
+        return []
+    events = []
+    if was_out:
+        events.append({"type": "close", "item_id": old["id"], "borrower": old.get("borrower"),
+                       "date": (today or date.today()).isoformat(), "borrowed": old.get("borrow_date")})
+    if is_out:
+        events.append(open_event(new, loan_days))
+    return events
+
+
+class LoanLedger:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.seq = 0                 # last event applied
+        self._open = {}              # item_id -> open event
+        self._by_borrower = {}       # borrower -> {item_id: open event}
+        self._due = []               # sorted (due, item_id) of open loans
+        self._history = {}           # item_id -> events
+        self._patron_history = {}    # borrower -> events
+
+    def rebuild(self, events, items=(), loan_days=14):
+        """Replays every event. Items that are checked out without an open
+        event (lent before the ledger existed) are indexed as open loans
+        too, so they show up for their borrower and as overdue."""
+        with self._lock:
+            self.clear()
+            for event in events:
+                self._apply(event)
+            for item in items:
+                if _on_loan(item) and item["id"] not in self._open:
+                    self._open_loan(open_event(item, loan_days))
+
+    def apply(self, event):
+        with self._lock:
+            self._apply(event)
+
+    def extend(self, events):
+        with self._lock:
+            for event in events:
+                self._apply(event)
+
+    def _apply(self, event):
+        if event["seq"] <= self.seq:
+            return
+        self.seq = event["seq"]
+        self._history.setdefault(event["item_id"], []).append(event)
+        self._patron_history.setdefault(event.get("borrower"), []).append(event)
+        self._close_loan(event["item_id"])
+        if event["type"] == "open":
+            self._open_loan(event)
+
+    def _open_loan(self, event):
+        item_id = event["item_id"]
+        self._open[item_id] = event
+        self._by_borrower.setdefault(event.get("borrower"), {})[item_id] = event
+        if event.get("due"):
+            bisect.insort(self._due, (event["due"], item_id))
+
+    def _close_loan(self, item_id):
+        event = self._open.pop(item_id, None)
+        if event is None:
+            return
+        loans = self._by_borrower[event.get("borrower")]
+        del loans[item_id]
+        if not loans:
+            del self._by_borrower[event.get("borrower")]
+        if event.get("due"):
+            i = bisect.bisect_left(self._due, (event["due"], item_id))
+            if i < len(self._due) and self._due[i] == (event["due"], item_id):
+                del self._due[i]
+
+    # --- QUERIES ---
+    def loans_of(self, borrower):
+        """Open loans of `borrower`, in the order they were made."""
+        with self._lock:
+            return list(self._by_borrower.get(borrower, {}).values())
+
+    def patron_history(self, borrower):
+        with self._lock:
+            return list(self._patron_history.get(borrower, ()))
+
+    def history(self, item_id):
+        with self._lock:
+            return list(self._history.get(item_id, ()))
+
+    def overdue(self, as_of, limit=None):
+        """Open loans due before `as_of`, most overdue first."""
+        with self._lock:
+            end = bisect.bisect_left(self._due, (as_of.isoformat(),))
+            if limit is not None:
+                end = min(end, limit)
+            return [self._open[item_id] for _, item_id in self._due[:end]]
@@ -0,0 +1,130 @@
+"""Process-wide counters and latency histograms, served by backend.py at
+GET /metrics in the Prometheus text format.
+
+    with metrics.timed("bookhaven_store_seconds", op="load"):
+        ...
+    metrics.inc("bookhaven_store_bytes_read_total", len(data))
+
+Every metric lives in this process only; with several server workers, each
+scrape is answered by whichever worker accepts it (the `pid` label tells
+them apart).
+"""
+import bisect
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds, Prometheus' default buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    "bookhaven_http_request_seconds": "Request latency by route, including streaming the body",
+    "bookhaven_http_requests_total": "Requests by route and status code",
+    "bookhaven_database_call_seconds": "Time spent in database.py functions",
+    "bookhaven_store_seconds": "Store internals: load/save/serialize/rebuild and lock waits",
+    "bookhaven_store_bytes_read_total": "Bytes read from the store files",
+    "bookhaven_store_bytes_written_total": "Bytes written to the store files",
+    "bookhaven_slow_requests_total": "Requests slower than the slow-request threshold",
+}
+
+_lock = threading.Lock()
+_histograms = {}   # name -> {labels: [bucket counts..., sum, count]}
+_counters = {}     # name -> {labels: value}
+_gauges = {}       # name -> (help, fn returning {labels: value})
+
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def observe(name, seconds, **labels):
+    i = bisect.bisect_left(BUCKETS, seconds)
+    with _lock:
+        series = _histograms.setdefault(name, {})
+        row = series.get(_key(labels))
+        if row is None:
+            row = series[_key(labels)] = [0] * (len(BUCKETS) + 2)
+        if i < len(BUCKETS):
+            row[i] += 1
+        row[-2] += seconds
+        row[-1] += 1
+
+
+def inc(name, amount=1, **labels):
+    with _lock:
+        series = _counters.setdefault(name, {})
+        series[_key(labels)] = series.get(_key(labels), 0) + amount
+
+
+def gauge(name, help_text, fn):
+    """Registers fn() -> {labels dict as tuple of pairs, or (): value},
+    evaluated at scrape time."""
+    _gauges[name] = (help_text, fn)
+
+
+@contextmanager
+def timed(name, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def timed_call(name, **labels):
+    """Decorator form of timed()."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(name, **labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return wrap
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+# --- EXPOSITION ---
+def _labels(pairs, extra=()):
+    pairs = [("pid", os.getpid())] + list(pairs) + list(extra)
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    with _lock:
+        histograms = {name: {k: list(row) for k, row in series.items()} for name, series in _histograms.items()}
+        counters = {name: dict(series) for name, series in _counters.items()}
+    lines = []
+    for name, series in sorted(histograms.items()):
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} histogram")
+        for key, row in sorted(series.items()):
+            cumulative = 0
+            for bound, n in zip(BUCKETS, row):
+                cumulative += n
+                lines.append(f"{name}_bucket{_labels(key, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(key, [('le', '+Inf')])} {row[-1]}")
+            lines.append(f"{name}_sum{_labels(key)} {row[-2]}")
+            lines.append(f"{name}_count{_labels(key)} {row[-1]}")
+    for name, series in sorted(counters.items()):
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} counter")
+        for key, value in sorted(series.items()):
+            lines.append(f"{name}{_labels(key)} {value}")
+    for name, (help_text, fn) in sorted(_gauges.items()):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for key, value in sorted(fn().items()):
+            lines.append(f"{name}{_labels(key)} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,76 @@
+"""Sampling profiler that can be switched on while the server runs.
+
+A background thread looks at every other thread's stack every `interval`
+seconds and counts each distinct stack. report() returns them in the
+"collapsed" format (frame;frame;frame count) that flamegraph.pl and
+speedscope read. Nothing is sampled while it is off.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class SamplingProfiler:
+    def __init__(self):
+        self._stacks = Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.interval = 0.005
+        self.samples = 0
+        self.started = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, interval=None):
+        """Starts sampling (clearing earlier samples). Returns False if it
+        was already running."""
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self.interval = interval or self.interval
+            self._stacks.clear()
+            self.samples = 0
+            self.started = time.time()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return False
+        self._stop.set()
+        thread.join()
+        return True
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, frame in frames.items():
+                    if ident != me:
+                        self._stacks[_collapse(frame)] += 1
+                self.samples += 1
+
+    def report(self, limit=None):
+        """Collapsed stacks, most frequent first."""
+        with self._lock:
+            stacks = self._stacks.most_common(limit)
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+
+def _collapse(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
@@ -0,0 +1,134 @@
+"""Compact in-memory form of a catalog item, used by the JSON store.
+
+A plain item dict costs a hash table plus a separate string object for
+every value, so "Book" or "Available" is stored again in each of a
+million items. An Item keeps the same fields in __slots__ instead:
+
+* category, status, author and borrower strings are interned, so every
+  item with the same value points at one shared string;
+* ISO dates (publication_date, borrow_date) are kept as day ordinals;
+* fields the item doesn't have are left out, exactly as in the dict.
+
+Items are read-only mappings, so store code and database.py use them like
+the dicts they replace (item["id"], item.get("status"), dict(item, ...)).
+They become plain dicts only when written out: to_dict() for the JSON
+snapshot and log, and json_default() for API responses.
+"""
+import sys
+from collections.abc import Mapping
+from datetime import date
+
+FIELDS = ("id", "name", "publication_date", "author", "category",
+          "status", "borrow_date", "borrower", "version")
+_INTERNED = frozenset(("category", "status", "author", "borrower"))
+_DATES = frozenset(("publication_date", "borrow_date"))
+_MISSING = object()
+
+
+def _pack_date(value):
+    if type(value) is str and len(value) == 10:
+        try:
+            day = date.fromisoformat(value)
+        except ValueError:
+            return value
+        return day.toordinal() if day.isoformat() == value else value
+    if type(value) is int:
+        return (value,)   # a real number, not to be read back as an ordinal
+    return value
+
+
+def _unpack_date(value):
+    if type(value) is int:
+        return date.fromordinal(value).isoformat()
+    if type(value) is tuple:
+        return value[0]
+    return value
+
+
+def _pack(field, value):
+    if field in _DATES:
+        return _pack_date(value)
+    if field in _INTERNED and type(value) is str:
+        return sys.intern(value)
+    return value
+
+
+class Item(Mapping):
+    __slots__ = FIELDS + ("extra",)
+
+    @classmethod
+    def from_dict(cls, data):
+        item = cls.__new__(cls)
+        for field in FIELDS:
+            value = data.get(field, _MISSING)
+            object.__setattr__(item, field, _MISSING if value is _MISSING else _pack(field, value))
+        extra = {k: v for k, v in data.items() if k not in _FIELD_SET}
+        object.__setattr__(item, "extra", extra or None)
+        return item
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Item is read-only; store a changed copy instead")
+
+    def __getitem__(self, key):
+        if key in _FIELD_SET:
+            value = getattr(self, key)
+            if value is _MISSING:
+                raise KeyError(key)
+            return _unpack_date(value) if key in _DATES else value
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key in _FIELD_SET:
+            value = getattr(self, key)
+            if value is _MISSING:
+                return default
+            return _unpack_date(value) if key in _DATES else value
+        return self.extra.get(key, default) if self.extra is not None else default
+
+    def __contains__(self, key):
+        if key in _FIELD_SET:
+            return getattr(self, key) is not _MISSING
+        return self.extra is not None and key in self.extra
+
+    def __iter__(self):
+        for field in FIELDS:
+            if getattr(self, field) is not _MISSING:
+                yield field
+        if self.extra is not None:
+            yield from self.extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def to_dict(self):
+        data = {}
+        for field in FIELDS:
+            value = getattr(self, field)
+            if value is not _MISSING:
+                data[field] = _unpack_date(value) if field in _DATES else value
+        if self.extra is not None:
+            data.update(self.extra)
+        return data
+
+    def __repr__(self):
+        return f"Item({self.to_dict()!r})"
+
+    def __reduce__(self):
+        return (Item.from_dict, (self.to_dict(),))
+
+
+_FIELD_SET = frozenset(FIELDS)
+
+
+def pack(item):
+    """The compact form of an item dict (Items are returned as they are)."""
+    return item if type(item) is Item else Item.from_dict(item)
+
+
+def json_default(obj):
+    """`default=` hook for json.dumps: serializes Items as plain objects."""
+    if isinstance(obj, Item):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
@@ -0,0 +1,255 @@
+"""In-memory inverted index behind /media/search.
+
+Two indexes are kept over each item's name and author:
+
+* a word index (token -> {item id: weight}) plus a sorted vocabulary, used
+  for ranked prefix matching and, through a trigram index over the
+  vocabulary, for fuzzy (edit-distance) matching;
+* a character trigram index (trigram -> sorted array of item ids), used to
+  answer the original "query is a substring of name or author" search by
+  checking only the items that contain its rarest trigram.
+
+The index is updated item by item from database.py, so it never has to be
+rebuilt on a normal create/edit/delete. Callers that show one page pass
+`limit`, and only that many of the best matches are picked (heapq) instead
+of sorting all of them.
+
+Cost, measured on benchmark.py's synthetic catalog at 100k items: the
+whole index takes ~49 MB (tracemalloc), of which ~10 MB are the trigram
+arrays (an item sits under each distinct trigram of its name and author,
+~26, at 4 bytes each); so ~250 MB per worker process at 500k items.
+Rebuilding takes ~2 s per 100k. Queries cost about 1 ms per ~1.5k
+matching items, because every match is still scored before the best
+`limit` are picked: rare words and multi-word queries stay well under a
+millisecond, while a very common single word does not.
+"""
+import bisect
+import heapq
+import re
+import sys
+import threading
+from array import array
+from collections import defaultdict
+
+MODES = ("smart", "prefix", "fuzzy", "substring")
+
+_WORD = re.compile(r"\w+")
+NAME_WEIGHT = 2
+AUTHOR_WEIGHT = 1
+
+
+def tokenize(text):
+    return _WORD.findall(text.lower())
+
+
+def _text(value):
+    """Lowercased field text; tolerates missing or non-string values."""
+    if value is None:
+        return ""
+    return (value if isinstance(value, str) else str(value)).lower()
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def edit_distance(a, b, limit):
+    """Levenshtein distance, or limit + 1 as soon as it must exceed `limit`."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        if min(cur) > limit:
+            return limit + 1
+        prev = cur
+    return prev[-1]
+
+
+def max_edits(term):
+    return 1 if len(term) <= 5 else 2
+
+
+class SearchIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._docs = {}                      # id -> (name, author) lowercased
+            self._postings = defaultdict(dict)   # token -> {id: weight}
+            self._vocab = []                     # sorted tokens, for prefix ranges
+            self._vocab_grams = defaultdict(set) # trigram -> tokens, for fuzzy
+            self._grams = defaultdict(_ids)      # trigram -> sorted ids, for substring
+
+    def __len__(self):
+        return len(self._docs)
+
+    # --- MAINTENANCE ---
+    def rebuild(self, items):
+        with self._lock:
+            self.clear()
+            for item in items:
+                self.add(item)
+
+    def add(self, item):
+        name = _text(item.get("name"))
+        author = sys.intern(_text(item.get("author")))   # shared by all of an author's items
+        item_id = item["id"]
+        with self._lock:
+            if item_id in self._docs:
+                self.remove(item_id)
+            self._docs[item_id] = (name, author)
+            for token, weight in self._weights(name, author).items():
+                postings = self._postings[token]
+                if not postings:
+                    self._add_token(token)
+                postings[item_id] = weight
+            for gram in trigrams(name) | trigrams(author):
+                ids = self._grams[gram]
+                if not ids or ids[-1] < item_id:
+                    ids.append(item_id)   # the usual case: ids only grow
+                else:
+                    bisect.insort(ids, item_id)
+
+    def remove(self, item_id):
+        with self._lock:
+            doc = self._docs.pop(item_id, None)
+            if doc is None:
+                return
+            name, author = doc
+            for token in self._weights(name, author):
+                postings = self._postings[token]
+                postings.pop(item_id, None)
+                if not postings:
+                    del self._postings[token]
+                    self._remove_token(token)
+            for gram in trigrams(name) | trigrams(author):
+                ids = self._grams[gram]
+                i = bisect.bisect_left(ids, item_id)
+                if i < len(ids) and ids[i] == item_id:
+                    del ids[i]
+                if not ids:
+                    del self._grams[gram]
+
+    def _weights(self, name, author):
+        weights = {}
+        for token in tokenize(author):
+            weights[token] = AUTHOR_WEIGHT
+        for token in tokenize(name):
+            weights[token] = NAME_WEIGHT
+        return weights
+
+    def _add_token(self, token):
+        bisect.insort(self._vocab, token)
+        for gram in trigrams(f"${token}$"):
+            self._vocab_grams[gram].add(token)
+
+    def _remove_token(self, token):
+        i = bisect.bisect_left(self._vocab, token)
+        if i < len(self._vocab) and self._vocab[i] == token:
+            del self._vocab[i]
+        for gram in trigrams(f"${token}$"):
+            tokens = self._vocab_grams[gram]
+            tokens.discard(token)
+            if not tokens:
+                del self._vocab_grams[gram]
+
+    # --- QUERIES ---
+    def search(self, query, mode="smart", limit=None):
+        """Returns matching item ids, best match first (only the best
+        `limit` of them if given).
+
+        smart:     prefix matching, falling back to fuzzy when nothing matches
+        prefix:    every query word is a prefix of a word in name/author
+        fuzzy:     like prefix, but words may also be a few typos away
+        substring: the original behaviour, the whole query appears in the
+                   name or author; results in id order
+        """
+        return self.ranked(query, mode, limit)[1]
+
+    def ranked(self, query, mode="smart", limit=None):
+        """Like search(), but returns (number of matches, ids)."""
+        if mode not in MODES:
+            raise ValueError(f"Unknown search mode. Allowed: {list(MODES)}")
+        query = query.lower().strip()
+        with self._lock:
+            if mode == "substring":
+                matches = self._substring(query)
+                return len(matches), _best(matches, None, limit)
+            terms = tokenize(query)
+            if not terms:
+                return 0, []
+            scores = self._match(terms, query, fuzzy=mode == "fuzzy")
+            if not scores and mode == "smart":
+                scores = self._match(terms, query, fuzzy=True)
+        ranked = [(-score, item_id) for item_id, score in scores.items()]
+        return len(ranked), [item_id for _, item_id in _best(ranked, None, limit)]
+
+    def _term_scores(self, term, fuzzy):
+        """Best score per item for one query word: exact word 3, prefix 2,
+        fuzzy 1, each multiplied by the field weight."""
+        scores = {}
+        lo = bisect.bisect_left(self._vocab, term)
+        hi = bisect.bisect_left(self._vocab, term + "\uffff")
+        for token in self._vocab[lo:hi]:
+            base = 3 if token == term else 2
+            postings = self._postings[token]
+            if not scores:
+                scores = {item_id: base * weight for item_id, weight in postings.items()}
+                continue
+            for item_id, weight in postings.items():
+                if base * weight > scores.get(item_id, 0):
+                    scores[item_id] = base * weight
+        if fuzzy:
+            limit = max_edits(term)
+            candidates = set()
+            for gram in trigrams(f"${term}$"):
+                candidates |= self._vocab_grams.get(gram, set())
+            for token in candidates:
+                if token.startswith(term) or edit_distance(term, token, limit) > limit:
+                    continue
+                for item_id, weight in self._postings[token].items():
+                    scores[item_id] = max(scores.get(item_id, 0), weight)
+        return scores
+
+    def _match(self, terms, query, fuzzy):
+        total = None
+        # Rarest terms first keeps the running intersection small
+        for per_term in sorted((self._term_scores(t, fuzzy) for t in terms), key=len):
+            if total is None:
+                total = dict(per_term)
+            else:
+                total = {i: s + per_term[i] for i, s in total.items() if i in per_term}
+            if not total:
+                return {}
+        docs = self._docs
+        return {item_id: score + (3 if docs[item_id][0].startswith(query) else query in docs[item_id][0])
+                for item_id, score in total.items()}
+
+    def _substring(self, query):
+        """Ids of the items containing `query`, in id order."""
+        if not query:
+            return list(self._docs)
+        grams = trigrams(query)
+        if grams:
+            # Every match contains each trigram: check the rarest one's items
+            candidates = min((self._grams.get(g, ()) for g in grams), key=len)
+        else:
+            candidates = self._docs  # 1-2 character queries: check every item
+        docs = self._docs
+        return [i for i in candidates if query in docs[i][0] or query in docs[i][1]]
+
+
+def _ids():
+    return array("i")
+
+
+def _best(ids, key, limit):
+    """`ids` sorted by `key`, or just the first `limit` of them."""
+    if limit is None or limit >= len(ids):
+        return sorted(ids, key=key)
+    return heapq.nsmallest(limit, ids, key=key)
@@ -0,0 +1,85 @@
+"""Multi-process HTTP server for backend.py without extra dependencies.
+
+The parent binds the listening socket and forks `workers` children; each
+child builds its own app (opening and warming up the store) and serves the
+shared socket with a threaded WSGI server, so the kernel spreads incoming
+connections over the workers. A worker that dies is replaced, unless it
+died right after starting (then the server gives up rather than loop).
+
+If gunicorn is available, it does the same job (with threads, since every
+open /media/events stream keeps one busy):
+
+    gunicorn -w 4 -k gthread --threads 32 -b 0.0.0.0:8000 "backend:create_app()"
+"""
+import os
+import signal
+import socket
+import time
+
+from werkzeug.serving import make_server
+
+MIN_WORKER_LIFETIME = 2.0   # seconds
+
+
+def _serve_child(create_app, host, port, sock):
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    server = make_server(host, port, create_app(), threaded=True, fd=sock.fileno())
+    server.serve_forever()
+
+
+def serve(create_app, host="127.0.0.1", port=8000, workers=1):
+    """Runs create_app() in `workers` processes until SIGINT/SIGTERM."""
+    if workers <= 1:
+        make_server(host, port, create_app(), threaded=True).serve_forever()
+        return
+    if not hasattr(os, "fork"):
+        raise RuntimeError("Several workers need fork(); use one worker or a WSGI server such as waitress")
+
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+    sock.set_inheritable(True)
+
+    children = {}              # pid -> start time
+    stopping = []
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _serve_child(create_app, host, port, sock)
+            finally:
+                os._exit(1)
+        children[pid] = time.monotonic()
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for _ in range(workers):
+        spawn()
+    while children:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        started = children.pop(pid, None)
+        if stopping or started is None:
+            continue
+        if time.monotonic() - started < MIN_WORKER_LIFETIME:
+            print(f"Worker {pid} failed at startup, shutting down")
+            stop(None, None)
+        else:
+            print(f"Worker {pid} exited, starting a new one")
+            spawn()
+    sock.close()
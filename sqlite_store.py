@@ -0,0 +1,333 @@
+"""SQLite storage backend.
+
+Items live in one indexed table, so category/status/borrower lookups and the
+/stats counts are index queries instead of scans over every record. Each
+thread gets its own connection; the database runs in WAL journal mode so
+readers never block the writer.
+
+Every committed put/delete is also written to the `changes` table (the item
+id and its previous state, under the revision it committed at), so server
+processes sharing the file can patch their in-memory indexes with each
+other's commits instead of rebuilding them (see take_foreign_changes).
+
+One-shot migration from the JSON store:
+
+    python sqlite_store.py media_store.json media_store.db
+"""
+import argparse
+import itertools
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import codec
+import metrics
+
+CHANGES_KEPT = 10000              # revisions of the change feed kept...
+CHANGES_PRUNE_EVERY = 1000        # ...pruned once per this many revisions
+
+FIELDS = ["id", "name", "publication_date", "author", "category",
+          "status", "borrow_date", "borrower", "version"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id               INTEGER PRIMARY KEY AUTOINCREMENT,
+    name             TEXT NOT NULL,
+    publication_date TEXT,
+    author           TEXT,
+    category         TEXT NOT NULL,
+    status           TEXT NOT NULL DEFAULT 'Available',
+    borrow_date      TEXT,
+    borrower         TEXT,
+    version          INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS idx_items_category ON items(category);
+CREATE INDEX IF NOT EXISTS idx_items_status   ON items(status);
+CREATE INDEX IF NOT EXISTS idx_items_borrower ON items(borrower);
+CREATE INDEX IF NOT EXISTS idx_items_name     ON items(name);
+CREATE INDEX IF NOT EXISTS idx_items_author   ON items(author);
+CREATE TABLE IF NOT EXISTS loans (
+    seq      INTEGER PRIMARY KEY AUTOINCREMENT,
+    item_id  INTEGER NOT NULL,
+    type     TEXT NOT NULL,
+    borrower TEXT,
+    date     TEXT,
+    due      TEXT,
+    borrowed TEXT
+);
+CREATE TABLE IF NOT EXISTS changes (
+    revision INTEGER NOT NULL,
+    item_id  INTEGER NOT NULL,
+    old      TEXT                  -- the item before the change, as JSON
+);
+CREATE INDEX IF NOT EXISTS idx_changes_revision ON changes(revision);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('revision', 0);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('changes_pruned', 0);
+"""
+
+LOAN_FIELDS = ["item_id", "type", "borrower", "date", "due", "borrowed"]
+
+_COLUMNS = ", ".join(FIELDS)
+_PLACEHOLDERS = ", ".join("?" for _ in FIELDS)
+
+
+def _row(cursor, row):
+    return {col[0]: value for col, value in zip(cursor.description, row)}
+
+
+class SqliteStore:
+    """Same interface as json_store.JsonStore, backed by an SQLite file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()     # one transaction per process at a time
+        self._local = threading.local()
+        self._generation = 0
+        self._seen = None                 # revision this process's indexes have caught up to
+        self.execute_script(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            # One per thread, and a fresh one after fork(). Autocommit mode:
+            # transactions are opened explicitly below
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            conn.row_factory = _row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            self._local.depth = 0
+            self._local.pending = []      # (item_id, old JSON) for the changes table
+            self._local.seen = None       # self._seen before this transaction's commit
+        return conn
+
+    def execute_script(self, script):
+        self._conn().executescript(script)
+
+    def load(self):
+        self._conn()
+
+    def invalidate(self):
+        pass
+
+    def disk_size(self):
+        return sum(os.path.getsize(p) for p in (self.path, self.path + "-wal") if os.path.exists(p))
+
+    def generation(self):
+        """Changes when other processes' commits could not be read back from
+        the change feed, so derived indexes must be rebuilt."""
+        return self._generation
+
+    def take_foreign_changes(self):
+        """(old, new) item pairs that other processes committed since the
+        last call, read from the changes table; several changes to one item
+        come back as one pair. Call it inside transaction() or snapshot(),
+        so the feed and the items are read at the same revision. Empty (and
+        generation() changes) if the feed was pruned past that point."""
+        with self.lock:
+            conn = self._conn()
+            revision = self.revision()
+            seen, self._seen = self._seen, revision
+            if seen is None or seen >= revision:
+                return []
+            if seen < conn.execute("SELECT value FROM meta WHERE key = 'changes_pruned'").fetchone()["value"]:
+                self._generation += 1
+                return []
+            olds = {}
+            for row in conn.execute("SELECT item_id, old FROM changes WHERE revision > ? AND revision <= ?"
+                                    " ORDER BY revision, rowid", (seen, revision)):
+                if row["item_id"] not in olds:
+                    olds[row["item_id"]] = None if row["old"] is None else codec.loads(row["old"])
+            changes = [(old, self.get(item_id)) for item_id, old in olds.items()]
+            return [(old, new) for old, new in changes if old is not None or new is not None]
+
+    # --- READS ---
+    def get(self, item_id):
+        return self._conn().execute("SELECT * FROM items WHERE id = ?", (int(item_id),)).fetchone()
+
+    def get_many(self, ids):
+        """The items for `ids`, in the same order (None where an id is gone),
+        fetched 500 ids per query."""
+        ids = iter(ids)
+        while True:
+            batch = [int(i) for i in itertools.islice(ids, 500)]
+            if not batch:
+                return
+            rows = self._conn().execute(f"SELECT * FROM items WHERE id IN ({', '.join('?' * len(batch))})",
+                                        batch).fetchall()
+            found = {row["id"]: row for row in rows}
+            yield from map(found.get, batch)
+
+    def all(self):
+        return self._conn().execute("SELECT * FROM items ORDER BY id").fetchall()
+
+    def iter_items(self, category=None, after_id=0):
+        """Yields items in id order, starting after `after_id`, a batch of
+        rows at a time."""
+        if category is None:
+            cursor = self._conn().execute("SELECT * FROM items WHERE id > ? ORDER BY id", (int(after_id),))
+        else:
+            cursor = self._conn().execute("SELECT * FROM items WHERE category = ? AND id > ? ORDER BY id",
+                                          (category, int(after_id)))
+        while True:
+            rows = cursor.fetchmany(500)
+            if not rows:
+                return
+            yield from rows
+
+    def page(self, category, field, descending, offset, limit):
+        """Items `offset`..`offset + limit` in `field` order (ties by id)."""
+        if field not in FIELDS:
+            raise ValueError(f"Unknown field: {field}")
+        where, args = ("WHERE category = ?", [category]) if category else ("", [])
+        order = f"{field} {'DESC' if descending else 'ASC'}, id"
+        return self._conn().execute(f"SELECT * FROM items {where} ORDER BY {order} LIMIT ? OFFSET ?",
+                                    args + [limit, offset]).fetchall()
+
+    def by_name(self, name):
+        return self._conn().execute("SELECT * FROM items WHERE name = ? ORDER BY id", (name,)).fetchall()
+
+    def iter_loans(self, after_seq=0):
+        """Yields loan ledger events (see loans.py) after `after_seq`."""
+        cursor = self._conn().execute("SELECT * FROM loans WHERE seq > ? ORDER BY seq", (int(after_seq),))
+        while True:
+            rows = cursor.fetchmany(500)
+            if not rows:
+                return
+            for row in rows:
+                yield {k: v for k, v in row.items() if v is not None or k == "borrower"}
+
+    @contextmanager
+    def snapshot(self):
+        """A consistent read of the whole database, e.g. to rebuild derived
+        indexes. It is a read transaction, so other processes can keep
+        committing meanwhile (WAL mode); only this process's writers wait."""
+        with self.lock:
+            conn = self._conn()
+            if self._local.depth:
+                yield self
+                return
+            conn.execute("BEGIN")
+            try:
+                yield self
+            finally:
+                conn.execute("COMMIT")
+
+    # --- WRITES ---
+    @contextmanager
+    def transaction(self):
+        """BEGIN IMMEDIATE takes the database write lock up front, so the
+        read-modify-write cannot interleave with another thread or process."""
+        with self.lock:
+            conn = self._conn()
+            outermost = self._local.depth == 0
+            if outermost:
+                with metrics.timed("bookhaven_store_seconds", op="lock_wait"):
+                    conn.execute("BEGIN IMMEDIATE")
+                self._local.pending, self._local.seen = [], None
+            self._local.depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._local.depth -= 1
+                if outermost:
+                    conn.execute("ROLLBACK")
+                    if self._local.seen is not None:
+                        self._seen = self._local.seen
+                raise
+            self._local.depth -= 1
+            if outermost:
+                with metrics.timed("bookhaven_store_seconds", op="save"):
+                    conn.execute("COMMIT")
+
+    def revision(self):
+        return self._conn().execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()["value"]
+
+    def bump_revision(self):
+        """Called once per committed transaction that changed something.
+        Also writes the transaction's changes to the change feed."""
+        conn = self._conn()
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'revision'")
+        revision = self.revision()
+        pending, self._local.pending = self._local.pending, []
+        conn.executemany("INSERT INTO changes (revision, item_id, old) VALUES (?, ?, ?)",
+                         [(revision, item_id, old) for item_id, old in pending])
+        if revision % CHANGES_PRUNE_EVERY == 0 and revision > CHANGES_KEPT:
+            conn.execute("DELETE FROM changes WHERE revision <= ?", (revision - CHANGES_KEPT,))
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'changes_pruned'", (revision - CHANGES_KEPT,))
+        if self._seen == revision - 1:
+            # Our own commit: nothing to replay for it (restored on rollback)
+            self._local.seen, self._seen = self._seen, revision
+        return revision
+
+    def allocate_id(self):
+        conn = self._conn()
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'items'").fetchone()
+        item_id = (row["seq"] if row else 0) + 1
+        if row:
+            conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'items'", (item_id,))
+        else:
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('items', ?)", (item_id,))
+        return item_id
+
+    def _pending(self, item_id, old):
+        """Queues a change for the change feed (written by bump_revision)."""
+        self._local.pending.append((item_id, None if old is None else codec.dumps_str(old)))
+
+    def put(self, item):
+        self._pending(item["id"], self.get(item["id"]))
+        self._conn().execute(f"INSERT OR REPLACE INTO items ({_COLUMNS}) VALUES ({_PLACEHOLDERS})",
+                             [item.get(f, 1 if f == "version" else None) for f in FIELDS])
+
+    def append_loan(self, event):
+        """Adds an event to the loan ledger; returns it with its `seq`."""
+        cursor = self._conn().execute(
+            f"INSERT INTO loans ({', '.join(LOAN_FIELDS)}) VALUES ({', '.join('?' for _ in LOAN_FIELDS)})",
+            [event.get(f) for f in LOAN_FIELDS])
+        return {"seq": cursor.lastrowid, **event}
+
+    def delete(self, item_id):
+        old = self.get(item_id)
+        if old is None:
+            return False
+        self._pending(old["id"], old)
+        return self._conn().execute("DELETE FROM items WHERE id = ?", (old["id"],)).rowcount > 0
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # --- MIGRATION ---
+    def import_json(self, json_path):
+        """Copies every item from a media_store.json file. Returns the count."""
+        with open(json_path, "rb") as f:
+            data, _ = codec.read_snapshot(f)
+        items = list(data.get("items", {}).values())
+        with self.transaction():
+            for item in items:
+                self.put(item)
+            for event in data.get("loans", []):
+                self.append_loan(event)
+            conn = self._conn()
+            conn.execute("DELETE FROM sqlite_sequence WHERE name = 'items'")
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('items', ?)",
+                         (data.get("next_id", 1) - 1,))
+        return len(items)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate media_store.json into SQLite")
+    parser.add_argument("source", nargs="?", default="media_store.json")
+    parser.add_argument("target", nargs="?", default="media_store.db")
+    args = parser.parse_args()
+    count = SqliteStore(args.target).import_json(args.source)
+    print(f"Imported {count} items into {args.target}")
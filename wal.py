@@ -0,0 +1,119 @@
+"""Append-only mutation log used by database.py in "wal" storage mode.
+
+Every create/update/borrow/return/delete appends one JSON line to the log
+instead of rewriting the whole store. The records are idempotent (a "put"
+carries the full item, a "del" only an id, a "rev" the store revision a
+transaction reached, a "loan" a ledger event with its sequence number), so
+replaying a log on top of a snapshot that already
+contains some of its records is harmless. JsonStore applies them.
+"""
+import json
+import os
+import time
+
+import codec
+
+
+def replay(path, apply, offset=0):
+    """Calls apply(record) for every complete record in `path` after byte
+    `offset`. Returns the offset just past the last record applied.
+
+    A torn last line (the process died, or is still writing) is ignored.
+    """
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = codec.loads(line)
+            except json.JSONDecodeError:
+                break
+            apply(record)
+            offset += len(line)
+    return offset
+
+
+class WriteAheadLog:
+    """Line-per-mutation log with batched fsync.
+
+    Records are flushed to the OS on every append, so a crashed process
+    loses nothing. fsync runs every `sync_every` records or `sync_interval`
+    seconds, which bounds what a power cut can lose. Callers serialize
+    access (JsonStore holds its lock and the cross-process file lock).
+    """
+
+    def __init__(self, path, sync_every=64, sync_interval=1.0):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self._fh = None
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def append(self, record):
+        self.append_many([record])
+
+    def append_many(self, records):
+        """Writes a batch of records (one transaction) with a single flush."""
+        if self._fh is None:
+            self.drop_torn_tail()
+            self._fh = open(self.path, "ab")
+        self._fh.write(b"".join(codec.dumps(r) + b"\n" for r in records))
+        self._fh.flush()
+        self._pending += len(records)
+        if self._pending >= self.sync_every or self.sync_due():
+            self.sync()
+
+    def drop_torn_tail(self):
+        """Cuts a half-written last line so new records start on a fresh line."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            content = f.read()
+            if content and not content.endswith(b"\n"):
+                f.truncate(content.rfind(b"\n") + 1)
+
+    def sync_due(self):
+        return self._pending and time.monotonic() - self._last_sync >= self.sync_interval
+
+    def sync(self):
+        if self._fh is not None and self._pending:
+            os.fsync(self._fh.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def truncate(self):
+        """Empties the log once its records are safely in a snapshot."""
+        self.close()
+        with open(self.path, "w", encoding="utf-8") as f:
+            os.fsync(f.fileno())
+
+    def rewind(self, size):
+        """Cuts the log back to `size` bytes, dropping a transaction whose
+        append failed part-way so none of its records are ever replayed."""
+        if self._fh is not None:
+            try:
+                self._fh.close()
+            except OSError:
+                pass   # the rest of the failed append, still buffered
+            self._fh = None
+        with open(self.path, "rb+") as f:
+            f.truncate(size)
+            os.fsync(f.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if self._fh is not None:
+            self.sync()
+            self._fh.close()
+            self._fh = None